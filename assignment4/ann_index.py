@@ -0,0 +1,154 @@
+"""
+DATA.ML.360 Recommender Systems
+Approximate nearest neighbor index of users with signed random projections.
+
+Every user is hashed in several tables by the signs of random projections
+of its (mean-centered) rating vector, so users with a small angle between
+their vectors tend to land in the same bucket. A query only computes the
+exact similarity to the users found in its buckets.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import numpy as np
+from scipy import sparse
+
+import similarity
+from ratings_store import RatingsStore
+
+# Average number of users per bucket when the number of bits is not given
+BUCKET_SIZE = 16
+
+
+class LSHIndex:
+    """
+    Locality-sensitive hashing index for finding similar users.
+
+    The recall and the latency are traded off with the number of tables and
+    bits (when built) and with probes (when queried): more tables and probes
+    find more candidates, more bits make the buckets smaller.
+    """
+
+    def __init__(
+        self,
+        store: RatingsStore,
+        similarity_type: str = "pearson",
+        n_tables: int = 8,
+        n_bits: int = None,
+        seed: int = 0,
+    ):
+        """
+        Hash all users of the store.
+
+        Args:
+            store (RatingsStore): ratings
+            similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+            n_tables (int): number of hash tables
+            n_bits (int): number of random projections (bits) per table,
+                by default enough for about BUCKET_SIZE users per bucket
+            seed (int): seed of the random projections
+
+        Raises:
+            ValueError: If the similarity type is unknown or n_bits is not
+                        between 1 and 62.
+        """
+
+        if similarity_type not in similarity.SIMILARITY_TYPES:
+            raise ValueError(f"Unknown similarity type {similarity_type}")
+        if n_bits is None:
+            n_bits = max(1, round(np.log2(store.shape[0] / BUCKET_SIZE)))
+        if not 1 <= n_bits <= 62:
+            raise ValueError("n_bits must be between 1 and 62")
+
+        self.store = store
+        self.similarity_type = similarity_type
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+
+        rng = np.random.default_rng(seed)
+        self.projections = rng.standard_normal((store.shape[1], n_tables * n_bits))
+        self._weights = 1 << np.arange(n_bits, dtype=np.int64)
+
+        # the users of every table sorted by their bucket code,
+        # so that a bucket is a range found with a binary search
+        codes = self._codes(self._project(None))
+        self.order = np.argsort(codes, axis=0, kind="stable").T
+        self.sorted_codes = np.take_along_axis(codes, self.order.T, axis=0).T
+
+    def _project(self, rows) -> np.ndarray:
+        """
+        Random projections of the users in rows (all if None),
+        shape (users, tables * bits).
+        """
+
+        csr = self.store.csr if rows is None else self.store.csr[rows]
+        values = similarity.rating_values(self.store, self.similarity_type, rows)
+        vectors = sparse.csr_matrix((values, csr.indices, csr.indptr), shape=csr.shape)
+        return vectors @ self.projections
+
+    def _codes(self, projected: np.ndarray) -> np.ndarray:
+        """
+        Bucket code of every table from the signs of the projections,
+        shape (users, tables).
+        """
+
+        bits = projected.reshape(len(projected), self.n_tables, self.n_bits) > 0
+        return bits @ self._weights
+
+    def candidates(self, user_id: int, probes: int = 0) -> np.ndarray:
+        """
+        Rows of the users that share a bucket with the user in some table.
+
+        Args:
+            user_id (int): active user
+            probes (int): number of extra buckets searched in every table.
+                The extra buckets differ from the user's bucket by the one
+                bit whose projection was closest to zero.
+
+        Returns:
+            np.ndarray: candidate rows, without the user itself
+        """
+
+        row = self.store.user_index[user_id]
+        projected = self._project(slice(row, row + 1))
+        code = self._codes(projected)[0]
+        margins = np.abs(projected[0]).reshape(self.n_tables, self.n_bits)
+
+        found = []
+        for table in range(self.n_tables):
+            flips = np.argsort(margins[table])[:probes]
+            for bucket in [code[table], *(code[table] ^ self._weights[flips])]:
+                start, end = np.searchsorted(
+                    self.sorted_codes[table], [bucket, bucket + 1]
+                )
+                found.append(self.order[table, start:end])
+
+        rows = np.unique(np.concatenate(found))
+        return rows[rows != row]
+
+    def similar_users(
+        self, user_id: int, k: int = None, probes: int = 0
+    ) -> list[tuple[int, float]]:
+        """
+        Approximate most similar users. The candidates are re-ranked by their
+        exact similarity, so the returned similarities are exact, but some of
+        the most similar users may be missing.
+
+        Args:
+            user_id (int): active user
+            k (int): number of users to return (all candidates if None)
+            probes (int): extra buckets per table (see candidates)
+
+        Returns:
+            list[tuple[int, float]]: (user_id, similarity) pairs in descending
+                                     order, ties in the store row order
+        """
+
+        rows = self.candidates(user_id, probes)
+        sims = similarity.similarity_to_users(
+            self.store, user_id, rows, self.similarity_type
+        )
+        order = similarity.top_k(sims, k)
+        return list(
+            zip(self.store.user_ids[rows[order]].tolist(), sims[order].tolist())
+        )
@@ -4,13 +4,37 @@ Antti Pham, Sophie Tötterström
 
 Reuse files from assignment 1
 """
+
 import argparse
+from typing import Union
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
+
+import movielens_cache
+import similarity
+from cache import LRUCache
+from ratings_store import RatingsStore
 
 SIMILAR_USERS = 10
 
+# What to do with the movies that none of the similar users has rated:
+# list them with the prediction 0 or leave them out
+MISSING_POLICIES = ("zero", "omit")
+
+# Maximum size of a block of similarities computed at once in recommend_many
+# (query users x all users)
+BLOCK_VALUES = 1 << 22
+
+# Groups of at most this many users read their similarities from the ratings
+# in one pass (similarity.similarity_to_all_many), which is cheaper than
+# building the similarity operands for all users
+SMALL_GROUP = 16
+
+# Ratings can be either the pivoted user-movie dataframe or the sparse store
+Ratings = Union[pd.DataFrame, RatingsStore]
+
 
 def parse_args():
     """
@@ -27,11 +51,36 @@ def parse_args():
     return args.ratingsfile
 
 
-def read_movielens(ratings_file_path):
+def read_movielens(
+    ratings_file_path,
+    sparse=False,
+    cache=False,
+    compact=False,
+    chunksize=None,
+    progress=None,
+) -> Ratings:
     """
     Read the MovieLens data from ratings_file_path
+
+    With sparse=True the ratings are returned as a RatingsStore, which only
+    stores the given ratings instead of a mostly NaN user-movie dataframe.
+    With cache=True the ratings are read as a RatingsStore through a binary
+    cache next to the csv file, which is much faster than parsing the csv.
+    With compact=True the RatingsStore keeps the ratings as 8-bit codes.
+    With chunksize the csv is streamed into a RatingsStore chunksize rows at
+    a time (progress is called after every chunk), for files that don't fit
+    in memory.
     """
+    if cache:
+        return movielens_cache.load_ratings(ratings_file_path, compact=compact)
+    if chunksize:
+        return RatingsStore.from_csv_chunks(
+            ratings_file_path, chunksize, compact=compact, progress=progress
+        )
+
     ratings = pd.read_csv(ratings_file_path)
+    if sparse or compact:
+        return RatingsStore.from_ratings(ratings, compact=compact)
 
     # create new dataframe where
     # userIds become the rows aka index
@@ -41,18 +90,92 @@ def read_movielens(ratings_file_path):
     return user_movie_df
 
 
+def as_ratings_store(user_movie_df: Ratings) -> RatingsStore:
+    """
+    Convert the ratings into a sparse store (no-op for a store)
+    """
+
+    if isinstance(user_movie_df, RatingsStore):
+        return user_movie_df
+    return RatingsStore.from_user_movie_df(user_movie_df)
+
+
+def get_user_data(user_movie_df: Ratings, user_id: int) -> pd.DataFrame:
+    """
+    Fetch the ratings of a user as a one column dataframe indexed by movieId
+    """
+
+    if isinstance(user_movie_df, RatingsStore):
+        return user_movie_df.user_ratings(user_id).to_frame()
+    return user_movie_df.loc[user_id].dropna().to_frame()
+
+
+def get_user_mean(user_movie_df: Ratings, user_id: int) -> float:
+    """
+    Mean of the ratings of a user
+    """
+
+    if isinstance(user_movie_df, RatingsStore):
+        return user_movie_df.user_mean(user_id)
+    return user_movie_df.loc[user_id].mean()
+
+
+def get_movie_rating(user_movie_df: Ratings, user_id: int, movie_id: int) -> float:
+    """
+    Fetch the rating of a user for a movie (NaN if the user has not rated it)
+    """
+
+    if isinstance(user_movie_df, RatingsStore):
+        return user_movie_df.rating(user_id, movie_id)
+    return user_movie_df.loc[user_id, movie_id]
+
+
+def get_movie_ratings(
+    user_movie_df: Ratings, user_id: int, movie_ids: np.ndarray
+) -> np.ndarray:
+    """
+    Fetch the ratings of a user for many movies (NaN for the movies the user
+    has not rated)
+    """
+
+    if isinstance(user_movie_df, RatingsStore):
+        ratings = user_movie_df.user_ratings(user_id)
+        return ratings.reindex(movie_ids).to_numpy(dtype=np.float64)
+    return user_movie_df.loc[user_id, movie_ids].to_numpy(dtype=np.float64)
+
+
+def get_user_ids(user_movie_df: Ratings) -> np.ndarray:
+    """
+    All user ids in ascending order
+    """
+
+    if isinstance(user_movie_df, RatingsStore):
+        return user_movie_df.user_ids
+    return user_movie_df.index.to_numpy()
+
+
+def get_movie_ids(user_movie_df: Ratings) -> np.ndarray:
+    """
+    All movie ids in ascending order
+    """
+
+    if isinstance(user_movie_df, RatingsStore):
+        return user_movie_df.movie_ids
+    return user_movie_df.columns.to_numpy()
+
+
 def pearson_corr(user_movie_df, user1, user2):
     """
     Calculate pearson correlation between users
     """
 
     # fetch user data from dataframe
-    user1_data = user_movie_df.loc[user1].dropna().to_frame()
-    user2_data = user_movie_df.loc[user2].dropna().to_frame()
+    user1_data = get_user_data(user_movie_df, user1)
+    user2_data = get_user_data(user_movie_df, user2)
 
     # calculate user data means
-    user1_mean = user1_data.mean().values[0]
-    user2_mean = user2_data.mean().values[0]
+    user1_mean = get_user_mean(user_movie_df, user1)
+    user2_mean = get_user_mean(user_movie_df, user2)
 
     # find common movies between the users
     common = user1_data.index.intersection(user2_data.index)
@@ -78,8 +201,8 @@ def cosine_sim(user_movie_df, user1, user2, adjusted=False):
     """
 
     # fetch user data from dataframe
-    user1_data = user_movie_df.loc[user1].dropna().to_frame()
-    user2_data = user_movie_df.loc[user2].dropna().to_frame()
+    user1_data = get_user_data(user_movie_df, user1)
+    user2_data = get_user_data(user_movie_df, user2)
 
     # find common movies between the users
     common = user1_data.index.intersection(user2_data.index)
@@ -94,8 +217,8 @@ def cosine_sim(user_movie_df, user1, user2, adjusted=False):
 
     # adjusted cosine similarity normalizes the ratings
     if adjusted:
-        user1_ratings = user1_ratings - user1_data.mean().values[0]
-        user2_ratings = user2_ratings - user2_data.mean().values[0]
+        user1_ratings = user1_ratings - get_user_mean(user_movie_df, user1)
+        user2_ratings = user2_ratings - get_user_mean(user_movie_df, user2)
 
     numerator = np.dot(user1_ratings.T, user2_ratings)
     denominator = np.linalg.norm(user1_ratings) * np.linalg.norm(user2_ratings)
@@ -116,22 +239,62 @@ def get_similarity(user_movie_df, user1, user2, similarity_type):
     return sim
 
 
-def get_similar_users(user_movie_df, user_id, similarity_type):
+def cached(
+    cache: LRUCache, key: tuple, user_movie_df: Ratings, compute
+) -> list[tuple[int, float]]:
+    """
+    Memoize a list computed from the ratings. The data version of the store
+    is added to the key, so results of older data are never returned.
+    Dataframes have no version, so their results are not cached.
+    A copy of the cached list is returned.
+    """
+
+    if cache is None or not isinstance(user_movie_df, RatingsStore):
+        return compute()
+    return list(cache.get_or_compute((*key, user_movie_df.version), compute))
+
+
+def get_similar_users(
+    user_movie_df,
+    user_id,
+    similarity_type,
+    k: int = None,
+    similarity_matrix: similarity.SimilarityMatrix = None,
+    cache: LRUCache = None,
+):
     """
     Calculate similarity for all users against active user
+
+    Same values as get_similarity for every user, but computed for all users
+    at once with sparse matrix operations. With a precomputed similarity
+    matrix the users are read from it instead (in O(k) when k is given).
+    With a cache, the result is memoized by (user_id, similarity_type, k,
+    data version).
+
+    Raises:
+        ValueError: If the similarity matrix is for another similarity type.
     """
 
-    sims = []
-    for other_user in user_movie_df.index:
-        if other_user != user_id:
-            sim = get_similarity(user_movie_df, user_id, other_user, similarity_type)
-            sims.append((other_user, sim))
-    sims.sort(key=lambda x: x[1], reverse=True)
-    return sims
+    if similarity_matrix is not None:
+        if similarity_matrix.similarity_type != similarity_type:
+            raise ValueError(
+                f"Similarity matrix is for {similarity_matrix.similarity_type} "
+                f"similarity, not {similarity_type}"
+            )
+
+    def compute() -> list[tuple[int, float]]:
+        if similarity_matrix is not None:
+            return similarity_matrix.similar_users(user_id, k)
+        store = as_ratings_store(user_movie_df)
+        sims = similarity.similarity_to_all(store, user_id, similarity_type)
+        return similarity.rank_users(store, sims, user_id, k)
+
+    key = ("similar_users", user_id, similarity_type, k)
+    return cached(cache, key, user_movie_df, compute)
 
 
 def predict(
-    user_movie_df: pd.DataFrame,
+    user_movie_df: Ratings,
     movie_id: int,
     similar_users: dict[int, float],
     user_id: int,
@@ -140,44 +303,391 @@ def predict(
 
     # Mean of the rating for user a
     a = user_id
-    a_mean = user_movie_df.loc[a].mean()
+    a_mean = get_user_mean(user_movie_df, a)
 
     # Get top N users who have rated the movie and are most similar to user a
     top_n_users = []
     for user, _ in similar_users:
-        if pd.isna(user_movie_df.loc[user, movie_id]):
+        if pd.isna(get_movie_rating(user_movie_df, user, movie_id)):
             continue
         top_n_users.append(user)
 
     numerator = 0
     denominator = 0
     for b in top_n_users:
-        b_mean = user_movie_df.loc[b].mean()
-        numerator += pearson_for_user[b] * (user_movie_df.loc[b, movie_id] - b_mean)
+        b_mean = get_user_mean(user_movie_df, b)
+        b_rating = get_movie_rating(user_movie_df, b, movie_id)
+        numerator += pearson_for_user[b] * (b_rating - b_mean)
         denominator += pearson_for_user[b]
 
     return (a_mean + numerator / denominator) if denominator else 0
 
 
+def predict_ratings(
+    user_mean: float,
+    neighbor_sims: np.ndarray,
+    centered: sparse.csr_matrix,
+    rated: sparse.csr_matrix,
+) -> np.ndarray:
+    """
+    Predict ratings for many movies at once with the same formula as predict.
+
+    Args:
+        user_mean (float): mean rating of the active user
+        neighbor_sims (np.ndarray): similarities of the k neighbors
+        centered (sparse.csr_matrix): mean-centered ratings of the neighbors,
+            shape (k, movies)
+        rated (sparse.csr_matrix): 1 where the neighbor has rated the movie,
+            same shape as centered
+
+    Returns:
+        np.ndarray: predicted rating for every movie (column), 0 when none
+                    of the neighbors has rated the movie
+    """
+
+    # only neighbors who have rated the movie are summed over
+    numerator = neighbor_sims @ centered
+    denominator = neighbor_sims @ rated
+
+    predictions = np.zeros(centered.shape[1])
+    valid = denominator != 0
+    predictions[valid] = user_mean + numerator[valid] / denominator[valid]
+    return predictions
+
+
 def get_top_movies(
-    user_movie_df: pd.DataFrame, user_id: int, similarity_type="pearson"
+    user_movie_df: Ratings,
+    user_id: int,
+    similarity_type="pearson",
+    similarity_matrix: similarity.SimilarityMatrix = None,
+    missing: str = "zero",
+    cache: LRUCache = None,
 ) -> list[tuple[int, float]]:
     """
     Returns matching movies for a given user
+
+    Only the movies rated by the similar users are predicted. The other
+    movies get the prediction 0 (missing="zero") or are left out
+    (missing="omit"). With a cache, the similar users and the result are
+    memoized by (user_id, similarity_type, k, data version).
+    """
+
+    def compute() -> list[tuple[int, float]]:
+        store = as_ratings_store(user_movie_df)
+        similar_users = get_similar_users(
+            store,
+            user_id,
+            similarity_type,
+            SIMILAR_USERS,
+            similarity_matrix,
+            cache,
+        )
+        return rank_movies(store, user_id, similar_users, missing)
+
+    key = ("top_movies", user_id, similarity_type, SIMILAR_USERS, missing)
+    return cached(cache, key, user_movie_df, compute)
+
+
+def rank_movies(
+    user_movie_df: Ratings,
+    user_id: int,
+    similar_users: list[tuple[int, float]],
+    missing: str = "zero",
+) -> list[tuple[int, float]]:
+    """
+    Predict movies for a user from its similar users and sort them by the
+    prediction in descending order, ties in the movie id order.
+
+    Only the candidate movies, which at least one similar user has rated,
+    are predicted (same values as predict). The rest have no prediction:
+    with missing="zero" they are listed with the prediction 0 (like predict
+    gives), with missing="omit" they are left out. A candidate keeps its
+    prediction even if it is 0, e.g. when the similarities sum to 0.
+
+    Raises:
+        ValueError: If the missing policy is unknown.
+    """
+
+    if missing not in MISSING_POLICIES:
+        raise ValueError(f"Unknown missing policy {missing}")
+
+    store = as_ratings_store(user_movie_df)
+    neighbor_rows = [store.user_index[user] for user, _ in similar_users]
+    neighbor_sims = np.array([sim for _, sim in similar_users], dtype=np.float64)
+    centered = store.centered(neighbor_rows)
+
+    # candidates: the movies rated by the similar users, as compact columns
+    candidates, cols = np.unique(centered.indices, return_inverse=True)
+    shape = (len(neighbor_rows), len(candidates))
+    centered = sparse.csr_matrix((centered.data, cols, centered.indptr), shape=shape)
+    rated = sparse.csr_matrix((np.ones(len(cols)), cols, centered.indptr), shape=shape)
+
+    user_mean = get_user_mean(store, user_id)
+    ratings = predict_ratings(user_mean, neighbor_sims, centered, rated)
+
+    # with missing="zero" the 0 predictions are listed together with the
+    # movies without a prediction, in the same order
+    if missing == "zero":
+        predicted = ratings != 0
+        candidates, ratings = candidates[predicted], ratings[predicted]
+    return sort_predictions(store, candidates, ratings, missing)
+
+
+def rank_movies_many(
+    user_movie_df: Ratings,
+    similar_users: dict[int, list[tuple[int, float]]],
+    missing: str = "zero",
+) -> dict[int, list[tuple[int, float]]]:
+    """
+    rank_movies for many users at once, with the same results.
+
+    The candidates are the movies rated by any neighbor of the users in a
+    block, found once for the block. The ratings of every user's neighbors
+    are summed into one dense (users x candidates) array with np.bincount,
+    in the order of the similar users like in rank_movies, and all users
+    of the block are sorted together. So a small group costs about as much
+    as one user, not one user per member.
+
+    Args:
+        user_movie_df (Ratings): ratings dataset
+        similar_users (dict[int, list[tuple[int, float]]]): similar users
+            of every active user
+        missing (str): policy for the movies without a prediction
+
+    Returns:
+        dict[int, list[tuple[int, float]]]: user_id, recommendation pairs
+
+    Raises:
+        ValueError: If the missing policy is unknown.
+    """
+
+    if missing not in MISSING_POLICIES:
+        raise ValueError(f"Unknown missing policy {missing}")
+
+    store = as_ratings_store(user_movie_df)
+    users = list(similar_users)
+    recs: dict[int, list[tuple[int, float]]] = {}
+    # the dense (block x candidates) sums have at most one row of movies
+    # per user
+    block_size = max(1, BLOCK_VALUES // store.shape[1])
+    for start in range(0, len(users), block_size):
+        block = users[start : start + block_size]
+
+        # neighbors in their order in the similar users, not sorted by row
+        lengths = [len(similar_users[user]) for user in block]
+        pairs = [pair for user in block for pair in similar_users[user]]
+        neighbors = [store.user_index[neighbor] for neighbor, _ in pairs]
+        sims = np.array([sim for _, sim in pairs], dtype=np.float64)
+
+        # only the rows of the neighbors of the block are read
+        neighbor_rows, cols = np.unique(
+            np.array(neighbors, dtype=int), return_inverse=True
+        )
+        centered = store.centered(neighbor_rows)
+
+        # candidates: the movies rated by any neighbor of the block, found
+        # once for the whole block, as compact columns
+        candidates, candidate_cols = np.unique(centered.indices, return_inverse=True)
+
+        # every (user, neighbor) pair expanded into the ratings of the neighbor,
+        # as positions in centered and cells of the (users x candidates) sums
+        cols = cols.reshape(-1)
+        counts = np.diff(centered.indptr)[cols]
+        offsets = np.cumsum(counts) - counts
+        positions = np.arange(counts.sum()) + np.repeat(
+            centered.indptr[cols] - offsets, counts
+        )
+        shape = (len(block), len(candidates))
+        first_cells = np.arange(len(block)) * len(candidates)
+        cells = np.repeat(np.repeat(first_cells, lengths), counts)
+        cells += candidate_cols[positions]
+        cell_sims = np.repeat(sims, counts)
+
+        # the cells are summed in the order of the similar users, like the
+        # products in rank_movies, so the predictions are the same
+        size = shape[0] * shape[1]
+        numerators = np.bincount(
+            cells, cell_sims * centered.data[positions], minlength=size
+        ).reshape(shape)
+        denominators = np.bincount(cells, cell_sims, minlength=size).reshape(shape)
+
+        valid = denominators != 0
+        means = np.array([get_user_mean(store, user) for user in block])
+        ratings = np.zeros(shape)
+        ratings[valid] = (
+            means[np.nonzero(valid)[0]] + numerators[valid] / denominators[valid]
+        )
+
+        if missing == "zero":
+            recs.update(zip(block, _sort_all_movies(store, candidates, ratings)))
+        else:
+            # every movie that a neighbor has rated has a prediction, also
+            # when the similarities sum to 0
+            rated_by = np.zeros(shape, dtype=bool)
+            rated_by.flat[cells] = True
+            recs.update(zip(block, _sort_rated(store, candidates, ratings, rated_by)))
+    return recs
+
+
+def _sort_all_movies(
+    store: RatingsStore, candidates: np.ndarray, ratings: np.ndarray
+) -> list[list[tuple[int, float]]]:
+    """
+    sort_predictions with missing="zero" for every row of ratings at once:
+    all movies sorted by the prediction (0 if none) in descending order, ties
+    in the movie id order.
     """
 
-    similar_users = get_similar_users(user_movie_df, user_id, similarity_type)[
-        :SIMILAR_USERS
+    all_ratings = np.zeros((len(ratings), store.shape[1]))
+    # a prediction of -0.0 is listed as 0 like the movies without one
+    all_ratings[:, candidates] = ratings + 0.0
+    order = np.argsort(-all_ratings, axis=1, kind="stable")
+    movies = get_movie_ids(store)[order].astype(int)
+    all_ratings = np.take_along_axis(all_ratings, order, axis=1)
+    return [
+        list(zip(user_movies, user_ratings))
+        for user_movies, user_ratings in zip(movies.tolist(), all_ratings.tolist())
     ]
 
-    # Movies that user a has not rated
-    movies = user_movie_df[user_movie_df[user_id].isnull()].columns.astype(int)
 
-    # Predict ratings for movies
-    predictions = [
-        (movie, predict(user_movie_df, movie, similar_users, user_id))
-        for movie in movies
+def _sort_rated(
+    store: RatingsStore,
+    candidates: np.ndarray,
+    ratings: np.ndarray,
+    rated_by: np.ndarray,
+) -> list[list[tuple[int, float]]]:
+    """
+    sort_predictions with missing="omit" for every row of ratings at once:
+    only the movies rated by a neighbor, sorted by the prediction in
+    descending order, ties in the movie id order.
+    """
+
+    rows, cols = np.nonzero(rated_by)
+    values = ratings[rows, cols]
+    order = np.lexsort((cols, -values, rows))
+    movies = get_movie_ids(store)[candidates[cols[order]]].astype(int).tolist()
+    values = values[order].tolist()
+    ends = np.cumsum(np.count_nonzero(rated_by, axis=1)).tolist()
+    return [
+        list(zip(movies[start:end], values[start:end]))
+        for start, end in zip([0, *ends], ends)
     ]
 
-    predictions.sort(key=lambda x: x[1], reverse=True)
-    return predictions
+
+def sort_predictions(
+    store: RatingsStore, candidates: np.ndarray, ratings: np.ndarray, missing: str
+) -> list[tuple[int, float]]:
+    """
+    (movie_id, prediction) pairs of the predicted columns in descending order,
+    ties in the movie id order. With missing="zero" the other movies are
+    listed with the prediction 0 between the positive and negative ones.
+    """
+
+    # sort in descending order, ties keep the movie id order
+    order = np.lexsort((candidates, -ratings))
+    candidates, ratings = candidates[order], ratings[order]
+
+    if missing == "zero":
+        # 0 predictions go between the positive and the negative ones
+        is_zero = np.ones(store.shape[1], dtype=bool)
+        is_zero[candidates] = False
+        zero_cols = np.flatnonzero(is_zero)
+        positive = np.count_nonzero(ratings > 0)
+        candidates = np.concatenate(
+            [candidates[:positive], zero_cols, candidates[positive:]]
+        )
+        ratings = np.concatenate(
+            [ratings[:positive], np.zeros(len(zero_cols)), ratings[positive:]]
+        )
+
+    movies = get_movie_ids(store)[candidates].astype(int)
+    return list(zip(movies.tolist(), ratings.tolist()))
+
+
+def recommend_many(
+    user_movie_df: Ratings,
+    user_ids: list[int],
+    similarity_type="pearson",
+    similarity_matrix: similarity.SimilarityMatrix = None,
+    missing: str = "zero",
+    cache: LRUCache = None,
+) -> dict[int, list[tuple[int, float]]]:
+    """
+    Returns matching movies for many users at once, the same lists as
+    get_top_movies gives for each user.
+
+    The ratings are converted only once. Groups of at most SMALL_GROUP
+    users get their similarities in one pass over the ratings, larger sets
+    build the similarity operands once and compute the similarities in
+    blocks of users with sparse matrix products.
+
+    Args:
+        user_movie_df (Ratings): ratings dataset
+        user_ids (list[int]): active users
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+        similarity_matrix (similarity.SimilarityMatrix): precomputed user
+            similarities to read the neighbors from (computed if None)
+        missing (str): policy for the movies without a prediction
+                       (see rank_movies)
+        cache (LRUCache): cache shared with get_top_movies, only the users
+                          that are not in it are computed
+
+    Returns:
+        dict[int, list[tuple[int, float]]]: user_id, recommendation pairs
+
+    Raises:
+        ValueError: If the similarity matrix is for another similarity type
+                    or the missing policy is unknown.
+    """
+
+    if cache is not None and isinstance(user_movie_df, RatingsStore):
+        recs = {}
+        for user in user_ids:
+            key = ("top_movies", user, similarity_type, SIMILAR_USERS, missing)
+            recs[user] = cache.get((*key, user_movie_df.version))
+        computed = recommend_many(
+            user_movie_df,
+            [user for user in user_ids if recs[user] is None],
+            similarity_type,
+            similarity_matrix,
+            missing,
+        )
+        for user, user_recs in computed.items():
+            key = ("top_movies", user, similarity_type, SIMILAR_USERS, missing)
+            cache.put((*key, user_movie_df.version), user_recs)
+            recs[user] = user_recs
+        return {user: list(recs[user]) for user in user_ids}
+
+    store = as_ratings_store(user_movie_df)
+
+    similar_users: dict[int, list[tuple[int, float]]] = {}
+    if similarity_matrix is not None:
+        for user in user_ids:
+            similar_users[user] = get_similar_users(
+                store, user, similarity_type, SIMILAR_USERS, similarity_matrix
+            )
+    else:
+        rows = [store.user_index[user] for user in user_ids]
+        block_size = max(1, BLOCK_VALUES // store.shape[0])
+        if len(rows) > SMALL_GROUP:
+            operands = similarity.similarity_operands(store, similarity_type)
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start : start + block_size]
+            if len(rows) > SMALL_GROUP:
+                sims = similarity.similarity_rows(operands, block_rows)
+            else:
+                sims = similarity.similarity_to_all_many(
+                    store, user_ids[start : start + block_size], similarity_type
+                )
+            for user, row, user_sims in zip(
+                user_ids[start : start + block_size], block_rows, sims
+            ):
+                order = similarity.top_k(user_sims, SIMILAR_USERS, exclude=row)
+                similar_users[user] = list(
+                    zip(store.user_ids[order].tolist(), user_sims[order].tolist())
+                )
+
+    # the neighbor ratings of all users are summed with np.bincount into
+    # dense (users x candidates) arrays, one block of users at a time
+    recs = rank_movies_many(store, similar_users, missing)
+    return {user: recs[user] for user in user_ids}
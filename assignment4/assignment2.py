@@ -10,9 +10,9 @@ Antti Pham, Sophie Tötterström
 from typing import Union
 
 import numpy as np
-import pandas as pd
 
-from assignment3 import GROUP
+import assignment1 as asg1
+import group_aggregation
 
 # N = 10
 # Two similar users, one dissimilar
@@ -62,7 +62,7 @@ def predict_without_similar_users(
 
 
 def get_rating(
-    user_movie_df: pd.DataFrame,
+    user_movie_df: asg1.Ratings,
     users_recs: dict[int, list[tuple[int, float]]],
     user: int,
     movie: int,
@@ -71,7 +71,7 @@ def get_rating(
     Either get real rating for the movie from user or predict it
     """
 
-    rating = user_movie_df.loc[user, movie]
+    rating = asg1.get_movie_rating(user_movie_df, user, movie)
     if np.isnan(rating):
         rating = predict_without_similar_users(users_recs, user, movie)
     return rating
@@ -87,69 +87,98 @@ def get_sorted_group_recs(pred_ratings: dict[int, float]) -> list[tuple[int, flo
 
 
 def average_aggregate(
-    user_movie_df: pd.DataFrame,
+    user_movie_df: asg1.Ratings,
     users_recs: dict[int, list[tuple[int, float]]],
     return_only_pred: bool = False,
+    group: list[int] = None,
 ) -> Union[list[tuple[int, float]], dict[int, float]]:
     """
     Perform average aggregation on recommendations for a group of users
     """
 
-    # first gather recommendations for each member of the group
-    group_recs: dict[int, list[tuple[int, float]]] = get_group_recs(users_recs)
+    return aggregate(user_movie_df, users_recs, "average", return_only_pred, group)
 
-    # now perform the average aggregation
-    avg_pred_ratings: dict[int, float] = {}
-    for movie, user_ratings in group_recs.items():
-        # add the recommended movie ratings
-        total = sum(nth_elements(user_ratings, 2))
 
-        # find ratings for users who this movie was not recommended to
-        not_recommended_to = set(GROUP) - set(nth_elements(user_ratings, 1))
-        for user in not_recommended_to:
-            total += get_rating(user_movie_df, users_recs, user, movie)
-
-        # now we have the total for this movie, lets perform calculation
-        avg_pred_ratings[movie] = total / len(GROUP)
+def least_misery_aggregate(
+    user_movie_df: asg1.Ratings,
+    users_recs: dict[int, list[tuple[int, float]]],
+    return_only_pred: bool = False,
+    group: list[int] = None,
+) -> Union[list[tuple[int, float]], dict[int, float]]:
+    """
+    Perform least misery aggregation on recommendations for a group of users
+    """
 
-    if return_only_pred:
-        return avg_pred_ratings
-    return get_sorted_group_recs(avg_pred_ratings)
+    return aggregate(user_movie_df, users_recs, "least_misery", return_only_pred, group)
 
 
-def least_misery_aggregate(
-    user_movie_df: pd.DataFrame,
+def aggregate(
+    user_movie_df: asg1.Ratings,
     users_recs: dict[int, list[tuple[int, float]]],
+    strategy: Union[str, group_aggregation.Strategy],
     return_only_pred: bool = False,
+    group: list[int] = None,
 ) -> Union[list[tuple[int, float]], dict[int, float]]:
     """
-    Perform least misery aggregation on recommendations for a group of users
+    Aggregate the recommendations of the group members with any strategy of
+    group_aggregation (e.g. "average", "least_misery", "most_pleasure",
+    "borda" or a weighted hybrid).
 
-    Returns:
+    Movies that were not recommended to a member are scored with the
+    member's real rating.
 
+    Args:
+        user_movie_df (asg1.Ratings): ratings dataset
+        users_recs (dict[int, list[tuple[int, float]]]): recommendations of
+            the group members
+        strategy (Union[str, group_aggregation.Strategy]): aggregation strategy
+        return_only_pred (bool): return movie_id -> group score in the order
+            of the movies instead of the sorted recommendations
+        group (list[int]): group members (the users of users_recs if None)
+
+    Returns:
+        Union[list[tuple[int, float]], dict[int, float]]: group recommendations
     """
 
-    # first gather recommendations for each member of the group
-    group_recs: dict[int, list[tuple[int, float]]] = get_group_recs(users_recs)
+    group_scores = group_aggregation.GroupScores.from_recs(
+        user_movie_df, users_recs, group
+    )
+    if return_only_pred:
+        return group_scores.as_dict(strategy)
+    return group_scores.ranking(strategy)
 
-    # now perform the average aggregation
-    least_misery_pred_ratings = {}
-    for movie, user_ratings in group_recs.items():
-        # add the recommended movie ratings
-        ratings = nth_elements(user_ratings, 2)
 
-        # find ratings for users who this movie was not recommended to
-        not_recommended_to = set(GROUP) - set(nth_elements(user_ratings, 1))
-        for user in not_recommended_to:
-            rating = get_rating(user_movie_df, users_recs, user, movie)
-            ratings.append(rating)
+def aggregate_many(
+    user_movie_df: asg1.Ratings,
+    users_recs: dict[int, list[tuple[int, float]]],
+    groups: list[list[int]],
+    strategy: Union[str, group_aggregation.Strategy],
+    return_only_pred: bool = False,
+) -> list[Union[list[tuple[int, float]], dict[int, float]]]:
+    """
+    Aggregate the recommendations of many groups in one pass. Gives the same
+    result as aggregate for each group, but the scores of a user are
+    gathered only once for all the groups the user is in.
+
+    Args:
+        user_movie_df (asg1.Ratings): ratings dataset
+        users_recs (dict[int, list[tuple[int, float]]]): recommendations of
+            the members of all groups
+        groups (list[list[int]]): members of every group, of any size
+        strategy (Union[str, group_aggregation.Strategy]): aggregation strategy
+        return_only_pred (bool): see aggregate
 
-        # now we have the total for this movie, lets perform calculation
-        least_misery_pred_ratings[movie] = min(ratings)
+    Returns:
+        list[Union[list[tuple[int, float]], dict[int, float]]]: group
+            recommendations of every group, in the order of groups
+    """
 
+    all_scores = group_aggregation.group_scores_many(
+        user_movie_df, users_recs, groups
+    )
     if return_only_pred:
-        return least_misery_pred_ratings
-    return get_sorted_group_recs(least_misery_pred_ratings)
+        return [group_scores.as_dict(strategy) for group_scores in all_scores]
+    return [group_scores.ranking(strategy) for group_scores in all_scores]
 
 
 def nth_elements(l: list[tuple[int, float]], n: int) -> list[int]:
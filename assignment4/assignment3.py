@@ -5,15 +5,15 @@ Main file for the assignment.
 Antti Pham, Sophie Tötterström
 """
 
-import pandas as pd
+import numpy as np
 
 import disagreement as disag
+import item_based
+import similarity
+from cache import LRUCache
 import assignment1 as asg1
 import assignment2 as asg2
 
-
-from assignment4 import GROUP, N
-
 # N = 10
 # GROUP = [233, 9, 242]
 # GROUP = [233, 423, 242]
@@ -48,6 +48,37 @@ def calc_satisfaction(group_recs: list[int], user_recs: list[int]) -> float:
     return satisfation
 
 
+def calc_satisfactions(
+    group_recs: list[int], users_recs: list[list[int]]
+) -> np.ndarray:
+    """
+    calc_satisfaction for all users at once, with one batched Kendall tau
+    calculation (disag.kendall_tau_many).
+
+    Args:
+        group_recs (list[int]): Movie recommendations for the group in the order
+                                of best to worst.
+        users_recs (list[list[int]]): Personal movie recommendations of every
+                                      user in the order of best to worst.
+
+    Returns:
+        np.ndarray: Satisfaction score of every user.
+
+    Raises:
+        ValueError: If a movie of group_recs is not in all users' lists.
+    """
+
+    n = len(group_recs)
+    if n <= 1:
+        return np.ones(len(users_recs))
+
+    distances = disag.kendall_tau_many(
+        disag.rank_arrays([group_recs], group_recs)[0],
+        disag.rank_arrays(users_recs, group_recs),
+    )
+    return 1 - distances / (n * (n - 1) / 2)
+
+
 def next_alpha(satisfactions: list[float]) -> float:
     """
     Calculate next alpha from the satisfaction scores of the previous iteration.
@@ -95,21 +126,45 @@ def weighted_combination(
 
 
 def get_movie_ratings_for_users(
-    user_movie_df: pd.DataFrame,
+    user_movie_df: asg1.Ratings,
+    users: list[int],
+    similarity_matrix: similarity.SimilarityMatrix = None,
+    item_neighbors: item_based.ItemNeighbors = None,
+    cache: LRUCache = None,
 ) -> dict[int, list[tuple[int, float]]]:
     """
     Gets user specific recommendations for all group members.
 
     Args:
-        user_movie_df (pd.DataFrame): ratings dataset
+        user_movie_df (asg1.Ratings): ratings dataset (dataframe or sparse store)
+        users (list[int]): members of the group, or of many groups at once
+            to share the recommendations of the common members
+        similarity_matrix (similarity.SimilarityMatrix): precomputed user
+            similarities to read the neighbors from (computed if None)
+        item_neighbors (item_based.ItemNeighbors): movie neighbor table, the
+            recommendations are item-based instead of user-based if given
+        cache (LRUCache): cache of the recommendations, for sessions that
+            ask for the recommendations of the same users many times
 
     Returns:
         dict[int, list[tuple[int, float]]]: user_id, recommendation pairs
     """
 
+    # every user only once, even if in many groups
+    users = list(dict.fromkeys(users))
+    # a dataframe is converted only once for all the users, and the
+    # recommendations of a store can be cached
+    store = asg1.as_ratings_store(user_movie_df)
+    if item_neighbors is None:
+        return asg1.recommend_many(
+            store, users, SIMILARITY_TYPE, similarity_matrix, cache=cache
+        )
+
     recs: dict[int, list[tuple[int, float]]] = {}
-    for user in GROUP:
-        recs[user] = asg1.get_top_movies(user_movie_df, user, SIMILARITY_TYPE)
+    for user in users:
+        recs[user] = item_based.get_top_movies(
+            store, user, SIMILARITY_TYPE, item_neighbors, cache=cache
+        )
     return recs
 
 
@@ -119,7 +174,7 @@ def main():
     user_movie_df = asg1.read_movielens(ratings_file_path=asg1.parse_args())
 
     # Get recommendations for all group members and aggregate
-    recs = get_movie_ratings_for_users(user_movie_df)
+    recs = get_movie_ratings_for_users(user_movie_df, GROUP)
     avg_group_recs = asg2.average_aggregate(user_movie_df, recs, return_only_pred=True)
     least_misery_group_recs = asg2.least_misery_aggregate(
         user_movie_df, recs, return_only_pred=True
@@ -7,6 +7,7 @@ Antti Pham, Sophie Tötterström
 
 import argparse
 import os
+import sys
 from collections import Counter
 import math
 
@@ -14,8 +15,13 @@ import pandas as pd
 from movie import Movie
 from tabulate import tabulate
 
+import assignment1 as asg1
 import assignment2 as asg2
 import assignment3 as asg3
+import item_based
+import movielens_cache
+import parallel
+import similarity
 
 # Number of recommendations
 N = 10
@@ -415,31 +421,110 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "path", help="Path to the local ml-latest-small directory.", type=str
     )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Keep the ratings in a sparse store instead of a dense dataframe.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Read the csv files through a binary cache saved next to them "
+        "(implies --sparse). The cache is rebuilt when a csv file changes.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Keep the ratings as 8-bit codes in the sparse store "
+        "(implies --sparse).",
+    )
+    parser.add_argument(
+        "--chunksize",
+        help="Stream ratings.csv into the sparse store this many rows at a "
+        "time, for datasets that don't fit in memory (implies --sparse).",
+        type=int,
+    )
+    parser.add_argument(
+        "--similarity-matrix",
+        help="Directory of a precomputed user similarity matrix. "
+        "The matrix is computed and saved there if it does not exist.",
+        type=str,
+    )
+    parser.add_argument(
+        "--processes",
+        help="Number of processes used to compute the similarity matrix "
+        "(all cores if not given).",
+        type=int,
+    )
+    parser.add_argument(
+        "--item-based",
+        action="store_true",
+        help="Recommend with item-based instead of user-based filtering.",
+    )
+    parser.add_argument(
+        "--item-neighbors",
+        help="Directory of a precomputed movie neighbor table for --item-based. "
+        "The table is computed and saved there if it does not exist.",
+        type=str,
+    )
 
     args = parser.parse_args()
     return args
 
 
-def read_movielens(dir_path: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+def print_progress(pass_number: int, rows_read: int) -> None:
+    """
+    Report the progress of streaming ratings.csv.
+    """
+
+    print(
+        f"Reading ratings.csv (pass {pass_number}/2): {rows_read} rows read",
+        file=sys.stderr,
+    )
+
+
+def read_movielens(
+    dir_path: str,
+    sparse: bool = False,
+    cache: bool = False,
+    compact: bool = False,
+    chunksize: int = None,
+) -> tuple[asg1.Ratings, pd.DataFrame]:
     """
     Read the MovieLens data from the given directory path.
 
     Args:
         dir_path (str): path to ml-latest-small directory
+        sparse (bool): return the ratings as a sparse RatingsStore instead of
+            a pivoted dataframe
+        cache (bool): read the csv files through the binary cache
+            (the ratings are returned as a RatingsStore)
+        compact (bool): keep the ratings as 8-bit codes in a RatingsStore
+        chunksize (int): stream ratings.csv into a RatingsStore this many rows
+            at a time
 
     Returns:
-        pd.DataFrame: user-movie ratings dataframe (ratings.csv)
+        asg1.Ratings: user-movie ratings (ratings.csv)
         pd.DataFrame]: movie-genre dataframe (movies.csv)
     """
 
     # Read ratings data
     ratings_file_path = os.path.join(dir_path, "ratings.csv")
-    ratings = pd.read_csv(ratings_file_path)
-    user_movie_df = ratings.pivot(index="userId", columns="movieId", values="rating")
+    user_movie_df = asg1.read_movielens(
+        ratings_file_path,
+        sparse=sparse,
+        cache=cache,
+        compact=compact,
+        chunksize=chunksize,
+        progress=print_progress,
+    )
 
     # Read movies genre data
     movies_file_path = os.path.join(dir_path, "movies.csv")
-    movies_genre_df = pd.read_csv(movies_file_path, index_col="movieId")
+    if cache:
+        movies_genre_df = movielens_cache.load_movies(movies_file_path)
+    else:
+        movies_genre_df = pd.read_csv(movies_file_path, index_col="movieId")
 
     return user_movie_df, movies_genre_df
 
@@ -499,17 +584,48 @@ def read_data() -> tuple[dict[int, Movie], list[int]]:
     """
     args = parse_args()
 
-    user_movie_df, movies_genre_df = read_movielens(dir_path=args.path)
+    user_movie_df, movies_genre_df = read_movielens(
+        dir_path=args.path,
+        sparse=args.sparse,
+        cache=args.cache,
+        compact=args.compact,
+        chunksize=args.chunksize,
+    )
     movies: dict[int, Movie] = process_movie_genre_data(movies_genre_df)
 
+    # the ratings are converted into the sparse store only once, all the
+    # steps below read the same store
+    store = asg1.as_ratings_store(user_movie_df)
+
+    # precomputed user similarities are reused between runs
+    similarity_matrix = None
+    if args.similarity_matrix:
+        similarity_matrix = similarity.load_matrix(
+            store, asg3.SIMILARITY_TYPE, args.similarity_matrix
+        )
+        if similarity_matrix is None:
+            similarity_matrix = parallel.build_similarity_matrix(
+                store,
+                asg3.SIMILARITY_TYPE,
+                args.similarity_matrix,
+                processes=args.processes,
+            )
+
+    # movie-movie similarities for item-based recommendations
+    item_neighbors = None
+    if args.item_based:
+        item_neighbors = item_based.load_or_build_neighbors(
+            store, asg3.SIMILARITY_TYPE, args.item_neighbors
+        )
+
     # user_id, list of tuples (movie_id, rating)
     recs: dict[int, list[tuple[int, float]]] = asg3.get_movie_ratings_for_users(
-        user_movie_df
+        store, GROUP, similarity_matrix, item_neighbors
     )
 
     # list of tuples (movie_id, avg_rating)
     avg_group_recs: list[tuple[int, float]] = asg2.average_aggregate(
-        user_movie_df, recs
+        store, recs, group=GROUP
     )
 
     # update movie objects with the most current data
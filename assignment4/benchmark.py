@@ -0,0 +1,250 @@
+"""
+DATA.ML.360 Recommender Systems
+Benchmarks of the faster implementations against the exact ones.
+
+Usage:
+    python benchmark.py ann <path/to/ml-latest-small/> [options]
+    python benchmark.py kendall [options]
+    python benchmark.py aggregation [options]
+
+Antti Pham, Sophie Tötterström
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from tabulate import tabulate
+
+import assignment1 as asg1
+import disagreement as disag
+from ann_index import LSHIndex
+
+K = 10
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Handle command-line args.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    ann = subparsers.add_parser(
+        "ann", help="Recall@10 and latency of the LSH index of similar users."
+    )
+    ann.add_argument("path", help="Path to the local ml-latest-small directory.")
+    ann.add_argument("--similarity", default="pearson", help="Similarity type.")
+    ann.add_argument("--queries", type=int, default=100, help="Number of users.")
+    ann.add_argument("--tables", type=int, default=8, help="Number of hash tables.")
+    ann.add_argument(
+        "--bits",
+        type=int,
+        help="Bits per hash table (chosen by the index if not given).",
+    )
+    ann.add_argument(
+        "--probes",
+        type=int,
+        nargs="+",
+        default=[0, 1, 2, 4],
+        help="Extra buckets per table to search.",
+    )
+    ann.add_argument("--seed", type=int, default=0)
+    ann.set_defaults(run=benchmark_ann)
+
+    kendall = subparsers.add_parser(
+        "kendall",
+        help="Latency of the merge sort Kendall tau against the quadratic one.",
+    )
+    kendall.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10_000, 100_000, 1_000_000],
+        help="Lengths of the compared lists.",
+    )
+    kendall.add_argument(
+        "--max-quadratic",
+        type=int,
+        default=2000,
+        help="Longest list for the quadratic version (it needs O(n^2) memory).",
+    )
+    kendall.add_argument("--seed", type=int, default=0)
+    kendall.set_defaults(run=benchmark_kendall)
+
+    aggregation = subparsers.add_parser(
+        "aggregation",
+        help="Disagreement and latency of the rank aggregators.",
+    )
+    aggregation.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[8, 12, 20, 50, 100],
+        help="Numbers of movies to order.",
+    )
+    aggregation.add_argument("--members", type=int, default=3, help="Group size.")
+    aggregation.add_argument(
+        "--groups", type=int, default=10, help="Random groups per size."
+    )
+    aggregation.add_argument(
+        "--max-exact",
+        type=int,
+        default=20,
+        help="Largest number of movies for the exact branch and bound.",
+    )
+    aggregation.add_argument("--seed", type=int, default=0)
+    aggregation.set_defaults(run=benchmark_aggregation)
+
+    return parser.parse_args()
+
+
+def timed(function, *args, **kwargs) -> tuple[object, float]:
+    """
+    Call the function and measure the wall-clock time in milliseconds.
+    """
+
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def benchmark_ann(args: argparse.Namespace) -> None:
+    """
+    Compare the LSH index against the exact get_similar_users ranking.
+    """
+
+    store = asg1.read_movielens(os.path.join(args.path, "ratings.csv"), sparse=True)
+    rng = np.random.default_rng(args.seed)
+    n_queries = min(args.queries, store.shape[0])
+    users = rng.choice(store.user_ids, n_queries, replace=False).tolist()
+
+    exact = {}
+    exact_ms = []
+    for user in users:
+        exact[user], ms = timed(asg1.get_similar_users, store, user, args.similarity, K)
+        exact_ms.append(ms)
+
+    index, build_ms = timed(
+        LSHIndex, store, args.similarity, args.tables, args.bits, args.seed
+    )
+    print(
+        f"{store.shape[0]} users, {store.nnz} ratings, "
+        f"{index.n_tables} tables of {index.n_bits} bits built in {build_ms:.0f} ms\n"
+    )
+
+    rows = [["exact", 1.0, store.shape[0] - 1, np.mean(exact_ms)]]
+    for probes in args.probes:
+        recalls = []
+        candidates = []
+        latencies = []
+        for user in users:
+            found, ms = timed(index.similar_users, user, K, probes)
+            latencies.append(ms)
+            candidates.append(len(index.candidates(user, probes)))
+            exact_users = {other for other, _ in exact[user]}
+            recalls.append(len(exact_users & {other for other, _ in found}) / K)
+        rows.append(
+            [
+                f"lsh probes={probes}",
+                np.mean(recalls),
+                np.mean(candidates),
+                np.mean(latencies),
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=["Method", f"Recall@{K}", "Candidates", "Latency (ms)"],
+            floatfmt=(".3f", ".3f", ".0f", ".2f"),
+        )
+    )
+
+
+def benchmark_kendall(args: argparse.Namespace) -> None:
+    """
+    Compare kendall_tau against kendall_tau_quadratic on random rankings.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    rows = []
+    for n in args.sizes:
+        movies1 = rng.permutation(n).tolist()
+        movies2 = rng.permutation(n).tolist()
+
+        tau, fast_ms = timed(disag.kendall_tau, movies1, movies2)
+        quadratic_ms = None
+        if n <= args.max_quadratic:
+            quadratic_tau, quadratic_ms = timed(
+                disag.kendall_tau_quadratic, movies1, movies2
+            )
+            if quadratic_tau != tau:
+                raise AssertionError(f"Different distances for n={n}")
+        rows.append([n, tau, quadratic_ms, fast_ms])
+
+    print(
+        tabulate(
+            rows,
+            headers=["Movies", "Distance", "Quadratic (ms)", "Merge sort (ms)"],
+            floatfmt=".2f",
+            missingval="-",
+        )
+    )
+
+
+def benchmark_aggregation(args: argparse.Namespace) -> None:
+    """
+    Compare the heuristic rank aggregators against the exact modified
+    Kemeny-Young on random member rankings.
+    """
+
+    def exact(recommendations_list: list[list[int]], n: int) -> disag.Aggregation:
+        order = disag.modified_kemeny_young(recommendations_list, n)
+        disagreement = disag.kendall_tau_disagreement(order, recommendations_list)
+        return disag.Aggregation(order, disagreement)
+
+    aggregators = {
+        "borda": disag.borda_aggregation,
+        "copeland": disag.copeland_aggregation,
+        "local search": disag.local_search_aggregation,
+        "exact": exact,
+    }
+
+    rng = np.random.default_rng(args.seed)
+    rows = []
+    for n in args.sizes:
+        # one extra movie, get_movies needs more common movies than n
+        groups = [
+            [rng.permutation(n + 1).tolist() for _ in range(args.members)]
+            for _ in range(args.groups)
+        ]
+        for name, aggregator in aggregators.items():
+            if name == "exact" and n > args.max_exact:
+                continue
+            disagreements = []
+            latencies = []
+            for recommendations_list in groups:
+                aggregation, ms = timed(aggregator, recommendations_list, n)
+                disagreements.append(aggregation.disagreement)
+                latencies.append(ms)
+            rows.append([n, name, np.mean(disagreements), np.mean(latencies)])
+
+    print(
+        tabulate(
+            rows,
+            headers=["Movies", "Method", "Disagreement", "Latency (ms)"],
+            floatfmt=(".0f", "", ".2f", ".2f"),
+        )
+    )
+
+
+def main():
+    args = parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
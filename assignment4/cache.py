@@ -0,0 +1,120 @@
+"""
+DATA.ML.360 Recommender Systems
+Least recently used cache for similar users and recommendations.
+
+Antti Pham, Sophie Tötterström
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple
+
+_MISSING = object()
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    size: int
+    entries: int
+
+
+class LRUCache:
+    """
+    Cache that evicts the least recently used entries when it is full.
+
+    By default every entry has size 1, so maxsize is the number of entries.
+    With sizeof, e.g. len for lists of recommendations, maxsize bounds the
+    total size of the cached values instead.
+
+    Results computed from the ratings are cached with the data version of
+    the RatingsStore in the key. A change of the ratings changes the version,
+    so the old entries are never returned again and are the first to be
+    evicted.
+    """
+
+    def __init__(self, maxsize: int = 1024, sizeof: Callable[[Any], int] = None):
+        """
+        Args:
+            maxsize (int): maximum total size of the entries
+            sizeof (Callable[[Any], int]): size of a value (1 if None)
+
+        Raises:
+            ValueError: If maxsize is negative.
+        """
+
+        if maxsize < 0:
+            raise ValueError("maxsize must not be negative")
+
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Cached value of the key (marked as the most recently used),
+        default if the key is not cached.
+        """
+
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Cache a value, evicting the least recently used entries if the
+        cache gets too big. Values bigger than maxsize are not cached.
+        """
+
+        size = 1 if self.sizeof is None else self.sizeof(value)
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        if size > self.maxsize:
+            return
+
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.maxsize:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Cached value of the key, or compute, cache and return it.
+        """
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        """
+        Remove all entries (the counters are kept).
+        """
+
+        self._entries.clear()
+        self.size = 0
+
+    def info(self) -> CacheInfo:
+        """
+        Hit and miss counters and the size of the cache.
+        """
+
+        return CacheInfo(
+            self.hits, self.misses, self.maxsize, self.size, len(self._entries)
+        )
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -5,7 +5,87 @@ File includes kendall tau calculations.
 Antti Pham, Sophie Tötterström
 """
 
-# from itertools import permutations
+from itertools import islice, permutations
+from typing import NamedTuple, Union
+
+import numpy as np
+
+# Maximum number of values in one block of the batched calculations
+BLOCK_VALUES = 1 << 22
+
+# Shorter lists are compared in plain Python, which has a smaller constant
+# cost than NumPy: lists with at most this many movies in total ...
+SHORT_LISTS = 5000
+# ... and at most this many common movies
+SHORT_COMMON = 64
+
+
+def common_positions(movies1: list[int], movies2: list[int]) -> np.ndarray:
+    """
+    Positions in movies2 of the movies that are in both lists,
+    in the order of movies1.
+
+    Raises:
+        ValueError: If there are duplicate movies in one list.
+    """
+
+    if len(movies1) + len(movies2) <= SHORT_LISTS:
+        common = set(movies1) & set(movies2)
+        common1 = [movie for movie in movies1 if movie in common]
+        common2 = [movie for movie in movies2 if movie in common]
+        if len(common1) != len(common) or len(common2) != len(common):
+            raise ValueError("Duplicate movies in one list")
+
+        position2 = {movie: i for i, movie in enumerate(common2)}
+        return np.array([position2[movie] for movie in common1], dtype=np.int64)
+
+    movies1 = np.asarray(movies1)
+    movies2 = np.asarray(movies2)
+    common1 = movies1[np.isin(movies1, movies2)]
+    common2 = movies2[np.isin(movies2, movies1)]
+    for common in (common1, common2):
+        if len(np.unique(common)) != len(common):
+            raise ValueError("Duplicate movies in one list")
+
+    order2 = np.argsort(common2)
+    return order2[np.searchsorted(common2[order2], common1)].astype(np.int64)
+
+
+def count_inversions(positions: np.ndarray) -> int:
+    """
+    Number of pairs i < j with positions[i] > positions[j], for a permutation
+    of 0, ..., n-1.
+
+    Bottom-up merge sort in O(n log n): on every level the sorted blocks are
+    merged pairwise with a stable sort (two sorted runs are merged in linear
+    time). A right block element that moves d places to the left in the
+    merge jumps over d greater elements of the left block. Short sequences
+    are counted with a double loop.
+    """
+
+    positions = np.asarray(positions, dtype=np.int64)
+    n = len(positions)
+    if n <= SHORT_COMMON:
+        positions = positions.tolist()
+        return sum(
+            positions[i] > positions[j] for i in range(n) for j in range(i + 1, n)
+        )
+
+    index = np.arange(n)
+
+    inversions = 0
+    width = 1
+    while width < n:
+        start = index // (2 * width) * (2 * width)
+        order = np.argsort(start * n + positions, kind="stable")
+        merged = np.empty(n, dtype=np.int64)
+        merged[order] = index
+
+        right = index >= np.minimum(start + width, n)
+        inversions += int((index - merged)[right].sum())
+        positions = positions[order]
+        width *= 2
+    return inversions
 
 
 def kendall_tau(movies1: list[int], movies2: list[int]) -> int:
@@ -13,6 +93,23 @@ def kendall_tau(movies1: list[int], movies2: list[int]) -> int:
     Calculate Kendall tau distance for two groups of movies.
     Movies that are not in both groups are ignored.
 
+    The distance is the number of inversions of the positions of the common
+    movies, counted with a merge sort in O(n log n).
+
+    Raises:
+        ValueError: If there are duplicate movies in one list,
+                    e.g. kendall_tau([1,2,3,4], [4,2,4,3])
+                    (duplicate 4 in second parameter).
+    """
+
+    return count_inversions(common_positions(movies1, movies2))
+
+
+def kendall_tau_quadratic(movies1: list[int], movies2: list[int]) -> int:
+    """
+    Kendall tau distance with a double loop in O(n^2) time and memory.
+    Same result as kendall_tau, kept as a reference for the benchmarks.
+
     Raises:
         ValueError: If there are duplicate movies in one list,
                     e.g. kendall_tau([1,2,3,4], [4,2,4,3])
@@ -84,6 +181,118 @@ def kendall_tau_disagreement(
     return abs(max_tau - min_tau)
 
 
+def rank_arrays(rankings: list[list[int]], movies: list[int]) -> np.ndarray:
+    """
+    Positions of the movies in every ranking, for the batched functions.
+
+    Args:
+        rankings (list[list[int]]): rankings of movies, best first
+        movies (list[int]): movies that are in all rankings
+
+    Returns:
+        np.ndarray: positions, shape (rankings, movies)
+
+    Raises:
+        ValueError: If a movie is not in all rankings or there are duplicate
+                    movies in movies or in a ranking.
+    """
+
+    movies = np.asarray(movies)
+    if len(np.unique(movies)) != len(movies):
+        raise ValueError("Duplicate movies in one list")
+
+    ranks = np.empty((len(rankings), len(movies)), dtype=np.int64)
+    for i, ranking in enumerate(rankings):
+        ranking = np.asarray(ranking)
+        order = np.argsort(ranking, kind="stable")
+        first, end = (
+            np.searchsorted(ranking[order], movies, side=side)
+            for side in ("left", "right")
+        )
+        if (end - first == 0).any():
+            raise ValueError("Movie not in all rankings")
+        if (end - first > 1).any():
+            raise ValueError("Duplicate movies in one list")
+        ranks[i] = order[first]
+    return ranks
+
+
+def pair_signs(ranks: np.ndarray) -> np.ndarray:
+    """
+    Order of every pair of movies in every ranking: +1 if the first movie of
+    the pair is ranked lower, -1 if it is ranked higher.
+
+    Args:
+        ranks (np.ndarray): positions of the movies, shape (rankings, movies)
+
+    Returns:
+        np.ndarray: signs, shape (rankings, movies * (movies - 1) / 2)
+    """
+
+    first, second = np.triu_indices(ranks.shape[1], 1)
+    return np.sign(ranks[:, first] - ranks[:, second]).astype(np.float64)
+
+
+def kendall_tau_many(candidates: np.ndarray, members: np.ndarray) -> np.ndarray:
+    """
+    Kendall tau distances of many candidate rankings to many member rankings
+    of the same movies at once.
+
+    With the pair signs s of two rankings, a pair agrees if the signs are
+    equal, so the dot product of the signs is (agreeing - disagreeing) pairs
+    and the distance is (pairs - dot product) / 2. The distances of all
+    candidates are one matrix product with the signs of the members.
+
+    The signs need movies^2 / 2 values per ranking, so this is for short
+    rankings (such as the top-N), use kendall_tau for long ones.
+
+    Args:
+        candidates (np.ndarray): positions of the movies (see rank_arrays),
+            shape (candidates, movies), or (movies,) for one candidate
+        members (np.ndarray): positions of the movies, shape (members, movies)
+
+    Returns:
+        np.ndarray: distances, shape (candidates, members), or (members,)
+                    for one candidate
+    """
+
+    candidates = np.asarray(candidates)
+    members_signs = pair_signs(np.atleast_2d(members))
+    n_pairs = members_signs.shape[1]
+
+    ranks = np.atleast_2d(candidates)
+    distances = np.empty((len(ranks), len(members_signs)), dtype=np.int64)
+    block_size = max(1, BLOCK_VALUES // max(1, n_pairs))
+    for start in range(0, len(ranks), block_size):
+        signs = pair_signs(ranks[start : start + block_size])
+        agreement = signs @ members_signs.T
+        distances[start : start + block_size] = np.rint((n_pairs - agreement) / 2)
+
+    if candidates.ndim == 1:
+        return distances[0]
+    return distances
+
+
+def kendall_tau_disagreement_many(
+    candidates: np.ndarray, members: np.ndarray
+) -> np.ndarray:
+    """
+    kendall_tau_disagreement of many candidate rankings at once, the
+    difference of the maximum and minimum distance to the members.
+
+    Args:
+        candidates (np.ndarray): positions of the movies, shape
+                                 (candidates, movies)
+        members (np.ndarray): positions of the movies, shape (members, movies)
+
+    Returns:
+        np.ndarray: disagreement of every candidate
+    """
+
+    distances = np.atleast_2d(kendall_tau_many(candidates, members))
+    return distances.max(axis=1) - distances.min(axis=1)
+
+
 def get_movies(recommendations_list: list[list[int]], n: int) -> list[int]:
     """
     Find n movies that are in all users' recommendations
@@ -109,50 +318,469 @@ def get_movies(recommendations_list: list[list[int]], n: int) -> list[int]:
     raise ValueError("Not enough common movies")
 
 
-# def modified_kemeny_young(recommendations_list: list[list[int]], n: int) -> list[int]:
-#     """
-#     Runs a modified version of the Kemeny-Young method.
+class PairwisePreferences:
+    """
+    Pairwise orders of the movies in the users' recommendations, computed
+    once so that the Kendall tau distances of any order of the movies are
+    table lookups instead of comparisons of the recommendation lists.
+    """
+
+    def __init__(self, movies: list[int], before: np.ndarray):
+        """
+        Args:
+            movies (list[int]): movie_id of each row and column
+            before (np.ndarray): before[u, a, b] is True if user u ranks movie
+                                 a before movie b, shape (users, movies, movies)
+        """
+
+        self.movies = movies
+        self.before = before
+        # counts[a, b]: number of users who rank movie a before movie b
+        self.counts = before.sum(axis=0)
+
+    @classmethod
+    def from_recommendations(
+        cls, recommendations_list: list[list[int]], n: int
+    ) -> "PairwisePreferences":
+        """
+        Tables of the n movies chosen like in modified_kemeny_young.
+
+        Raises:
+            ValueError: If there are not enough common movies in the
+                        recommendations.
+        """
+
+        movies = get_movies(recommendations_list, n)
+        ranks = rank_arrays(recommendations_list, movies)
+        return cls(movies, ranks[:, :, np.newaxis] < ranks[:, np.newaxis, :])
+
+    def distances(self, orders: np.ndarray) -> np.ndarray:
+        """
+        Kendall tau distances of orders of the movies to every user.
+
+        Args:
+            orders (np.ndarray): orders as movie indices (rows of the tables),
+                shape (movies,) for one order or (orders, movies)
+
+        Returns:
+            np.ndarray: distances, shape (users,) or (orders, users)
+        """
+
+        orders = np.asarray(orders)
+        # pairs[..., u, i, j]: user u ranks the movie at i before the one at j,
+        # a pair i < j disagrees if the user ranks the movie at j first
+        pairs = self.before[:, orders[..., :, np.newaxis], orders[..., np.newaxis, :]]
+        distances = np.tril(pairs, -1).sum(axis=(-2, -1))
+        return np.moveaxis(distances, 0, -1)
+
+    def disagreement(self, orders: np.ndarray) -> Union[int, np.ndarray]:
+        """
+        Kendall tau disagreement (max - min distance) of one or many orders.
+        """
+
+        distances = self.distances(orders)
+        disagreement = distances.max(axis=-1) - distances.min(axis=-1)
+        return int(disagreement) if disagreement.ndim == 0 else disagreement
+
+    def bitmasks(self) -> list[list[int]]:
+        """
+        The tables as bitmasks for the exact solvers: bit j of
+        bitmasks[u][i] is set if user u ranks movie j before movie i.
+        """
+
+        return [
+            [
+                sum(1 << int(j) for j in np.flatnonzero(user_before[:, i]))
+                for i in range(len(self.movies))
+            ]
+            for user_before in self.before
+        ]
+
+
+KEMENY_METHODS = ("branch_and_bound", "dp", "permutations")
+
+# Largest number of movies that method="dp" orders (see kemeny_dp)
+DP_MAX_MOVIES = 13
+
+
+def modified_kemeny_young(
+    recommendations_list: list[list[int]],
+    n: int,
+    method: str = "branch_and_bound",
+) -> list[int]:
+    """
+    Runs a modified version of the Kemeny-Young method.
+
+    Finds the order of the movies with the smallest disagreement (based on
+    the Kendall tau distance) with the users' recommendations. Of the orders
+    with the same disagreement, the first one in the order of
+    itertools.permutations(movies) is returned, so all methods give the
+    same order:
+
+    - "permutations" goes through all permutations in O(n!*n^2).
+    - "dp" goes through the subsets of the movies (see kemeny_dp), for at
+      most DP_MAX_MOVIES movies.
+    - "branch_and_bound" goes through the permutations in the same order,
+      but skips the prefixes whose lower bound cannot beat the best order
+      found so far (see kemeny_branch_and_bound). Fastest, n of 20-25
+      movies are ordered in milliseconds for small groups.
+
+    Movies are chosen in the order of
+    - the first movies of all the users
+    - the second movies of all the users
+    - the third movies of all the users
+    - etc.
+
+    Args:
+        recommendations_list (list[list[int]]): List of list of user's recommendations.
+        n (int): number of movies to order
+        method (str): "branch_and_bound", "dp" or "permutations"
+
+    Returns:
+        list[int]: A n-sized list of movies in the order of the best permutation.
+
+    Raises:
+        ValueError: If there are not enough common movies in the recommendations,
+                    the method is unknown or method="dp" has more than
+                    DP_MAX_MOVIES movies to order.
+    """
+
+    if method not in KEMENY_METHODS:
+        raise ValueError(f"Unknown Kemeny-Young method {method}")
+    if method == "dp" and n > DP_MAX_MOVIES:
+        raise ValueError(
+            f"Kemeny-Young method dp orders at most {DP_MAX_MOVIES} movies, not {n}"
+        )
+
+    # Get the movies that are in all users' recommendations
+    preferences = PairwisePreferences.from_recommendations(recommendations_list, n)
+    movies = preferences.movies
+
+    if method == "permutations":
+        # Find the best permutation (aka order of recommendations),
+        # the permutations are evaluated in blocks with the tables
+        n_values = len(preferences.before) * len(movies) ** 2
+        block_size = max(1, BLOCK_VALUES // max(1, n_values))
+        orders = permutations(range(len(movies)))
+        best_recs_order: list[int] = []
+        min_tau = float("inf")
+        while block := list(islice(orders, block_size)):
+            taus = preferences.disagreement(np.array(block).reshape(len(block), -1))
+            best = int(np.argmin(taus))
+            if taus[best] < min_tau:
+                min_tau = taus[best]
+                best_recs_order = [movies[i] for i in block[best]]
+        return best_recs_order
+
+    before = preferences.bitmasks()
+    if method == "dp":
+        order = kemeny_dp(before)
+    else:
+        order = kemeny_branch_and_bound(before)
+    return [movies[i] for i in order]
+
+
+def _spread(distances: tuple[int, ...]) -> int:
+    """
+    Disagreement from the differences of the distances of the other users
+    to the distance of the first user.
+    """
+
+    return max((0, *distances)) - min((0, *distances))
+
+
+def kemeny_dp(before: list[list[int]]) -> list[int]:
+    """
+    Exact modified Kemeny-Young with dynamic programming over the subsets
+    of the movies.
+
+    The disagreement (max - min distance) is not a sum over the movie
+    pairs, so a subset does not have a single best cost like in the
+    Kemeny-Young method. Instead, every subset R keeps the set of
+    distance difference vectors (distance of each user minus the distance
+    of the first user) that the orders of R can give, counting the pairs
+    inside R. Placing movie x first in front of R adds the pairs (x, r)
+    to the vectors:
+
+        F(R) = union over x in R of F(R - {x}) + cost(x, R - {x})
+
+    The time is O(2^n * n * V) where V is the number of different vectors
+    of a subset, at most (n^2 / 2)^(users - 1), so this is for about n <= 13
+    (a few seconds for a group of three).
+    The order is rebuilt by choosing at each position the first movie
+    that can still reach the optimum.
+
+    Args:
+        before (list[list[int]]): pairwise orders of the users
+            (PairwisePreferences.bitmasks)
+
+    Returns:
+        list[int]: indices of the movies in the best order
+    """
+
+    n = len(before[0])
+    full = (1 << n) - 1
+
+    # a vector is stored as one integer with a digit in base 2 * pairs + 1
+    # for every user (digits may be negative), so shifting is an addition
+    n_pairs = n * (n - 1) // 2
+    base = 2 * n_pairs + 1
+
+    def cost(x: int, rest: int) -> int:
+        # pairs (x, r) with x first that each user has the other way around
+        distances = [(user_before[x] & rest).bit_count() for user_before in before]
+        return sum(
+            (distance - distances[0]) * base**i
+            for i, distance in enumerate(distances[1:])
+        )
+
+    def spread(vector: int) -> int:
+        digits = []
+        for _ in range(len(before) - 1):
+            digit = (vector + n_pairs) % base - n_pairs
+            digits.append(digit)
+            vector = (vector - digit) // base
+        return _spread(tuple(digits))
+
+    # vectors of every subset (the subsets of a subset are smaller numbers)
+    reachable: list[set[int]] = [{0}]
+    for subset in range(1, full + 1):
+        vectors = set()
+        for x in range(n):
+            if subset >> x & 1:
+                rest = subset & ~(1 << x)
+                step = cost(x, rest)
+                vectors.update(vector + step for vector in reachable[rest])
+        reachable.append(vectors)
+
+    best = min(spread(vector) for vector in reachable[full])
+
+    # the first movie of every position that still reaches the best order
+    order: list[int] = []
+    remaining = full
+    done = 0
+    while remaining:
+        for x in range(n):
+            if remaining >> x & 1:
+                rest = remaining & ~(1 << x)
+                prefix = done + cost(x, rest)
+                if any(spread(prefix + vector) == best for vector in reachable[rest]):
+                    order.append(x)
+                    remaining, done = rest, prefix
+                    break
+    return order
+
+
+def kemeny_branch_and_bound(before: list[list[int]]) -> list[int]:
+    """
+    Exact modified Kemeny-Young with branch and bound.
+
+    Goes through the prefixes of the orders in the order of
+    itertools.permutations and skips a prefix when its lower bound is not
+    smaller than the best disagreement found so far. A prefix fixes the
+    distance of every user on all pairs with a movie in the prefix. For
+    two users, the pairs of the remaining movies that they order
+    differently (pairwise majority of two) can change the difference of
+    their distances by one each, and the pairs they agree on cannot change
+    it, so
+
+        disagreement >= |fixed_u - fixed_w| - differing_uw
+
+    for every pair of users u, w (with the parity of differing_uw when
+    that is negative). For groups of a few users the bound is tight enough
+    to order 20-25 movies in milliseconds, with many users it gets weaker.
+
+    Args:
+        before (list[list[int]]): pairwise orders of the users
+            (PairwisePreferences.bitmasks)
+
+    Returns:
+        list[int]: indices of the movies in the best order
+    """
 
-#     Goes through all possible permutations of the recommendations and calculates
-#     the disagreement (based on the Kendall tau distance) for each permutation.
-#     The permutation with the disagreement is returned.
+    n = len(before[0])
+    users = range(len(before))
+    user_pairs = [(u, w) for u in users for w in users if u < w]
+    # bit j of differ[p][i]: the users of pair p order the movies i and j
+    # differently
+    differ = [[before[u][i] ^ before[w][i] for i in range(n)] for u, w in user_pairs]
+
+    best_order: list[int] = []
+    best = float("inf")
+
+    def lower_bound(fixed: list[int], differing: list[int]) -> int:
+        bound = 0
+        for (u, w), free in zip(user_pairs, differing):
+            gap = abs(fixed[u] - fixed[w])
+            bound = max(bound, gap - free if gap >= free else (gap - free) % 2)
+        return bound
+
+    def search(
+        prefix: list[int], remaining: int, fixed: list[int], differing: list[int]
+    ):
+        nonlocal best, best_order
+
+        if not remaining:
+            spread = max(fixed) - min(fixed)
+            if spread < best:
+                best, best_order = spread, list(prefix)
+            return
+
+        for x in range(n):
+            if not remaining >> x & 1:
+                continue
+            rest = remaining & ~(1 << x)
+            # x goes before all remaining movies
+            next_fixed = [
+                distance + (user_before[x] & rest).bit_count()
+                for distance, user_before in zip(fixed, before)
+            ]
+            next_differing = [
+                free - (pair_differ[x] & rest).bit_count()
+                for free, pair_differ in zip(differing, differ)
+            ]
+            if lower_bound(next_fixed, next_differing) >= best:
+                continue
+            prefix.append(x)
+            search(prefix, rest, next_fixed, next_differing)
+            prefix.pop()
+
+    full = (1 << n) - 1
+    differing = [
+        sum((pair_differ[i] & full).bit_count() for i in range(n)) // 2
+        for pair_differ in differ
+    ]
+    search([], full, [0 for _ in users], differing)
+    return best_order
+
+
+class Aggregation(NamedTuple):
+    """
+    Group order of the movies found by an aggregator, with its Kendall tau
+    disagreement (max - min distance to the users' recommendations).
+    """
 
-#     The function goes through all permutations, so the time complexity is O(n!*n^2).
+    order: list[int]
+    disagreement: int
 
-#     Movies are chosen in the order of
-#     - the first movies of all the users
-#     - the second movies of all the users
-#     - the third movies of all the users
-#     - etc.
 
-#     Args:
-#         recommendations_list (list[list[int]]): List of list of user's recommendations.
+def _aggregation(preferences: PairwisePreferences, order: np.ndarray) -> Aggregation:
+    """
+    Aggregation of the movie indices in order, with its disagreement.
+    """
 
-#     Returns:
-#         list[int]: A n-sized list of movies in the order of the best permutation.
+    return Aggregation(
+        [preferences.movies[i] for i in order], preferences.disagreement(order)
+    )
 
-#     Raises:
-#         ValueError: If there are not enough common movies in the recommendations.
-#     """
 
-#     # Get the movies that are in all users' recommendations
-#     movies = get_movies(recommendations_list, n)
+def borda_aggregation(recommendations_list: list[list[int]], n: int) -> Aggregation:
+    """
+    Orders the movies by their Borda count: every user gives a movie as many
+    points as there are movies ranked lower by the user. Ties keep the order
+    of the movies (see modified_kemeny_young). O(users * n + n log n).
 
-#     # Simplify the user recommendations to only contain the common movies
-#     recommendations_list = [
-#         [movie for movie in recommendations if movie in movies]
-#         for recommendations in recommendations_list
-#     ]
-#     # print(recommendations_list)
-#     # print(movies)
+    Raises:
+        ValueError: If there are not enough common movies in the recommendations.
+    """
 
-#     # Find the best permutation (aka order of recommendations)
-#     best_recs_order: list[int] = []
-#     min_tau = float("inf")
-#     for recc_order in permutations(movies):
-#         tau = kendall_tau_disagreement(recc_order, recommendations_list)
-#         if tau < min_tau:
-#             min_tau = tau
-#             best_recs_order = recc_order
+    preferences = PairwisePreferences.from_recommendations(recommendations_list, n)
+    points = preferences.counts.sum(axis=1)
+    return _aggregation(preferences, np.argsort(-points, kind="stable"))
+
+
+def copeland_aggregation(recommendations_list: list[list[int]], n: int) -> Aggregation:
+    """
+    Orders the movies by their Copeland score: the number of movies that a
+    majority of the users ranks lower minus the number of movies that a
+    majority ranks higher. Ties keep the order of the movies.
+    O(users * n^2).
+
+    Raises:
+        ValueError: If there are not enough common movies in the recommendations.
+    """
+
+    preferences = PairwisePreferences.from_recommendations(recommendations_list, n)
+    wins = preferences.counts
+    score = (wins > wins.T).sum(axis=1) - (wins < wins.T).sum(axis=1)
+    return _aggregation(preferences, np.argsort(-score, kind="stable"))
+
+
+def local_search_aggregation(
+    recommendations_list: list[list[int]],
+    n: int,
+    start: Union[str, list[int]] = "borda",
+    max_rounds: int = 100,
+) -> Aggregation:
+    """
+    Improves an order by moving one movie at a time to a better position.
+
+    The moves are all insertions of a movie at another position, which
+    include the swaps of adjacent movies. Moving a movie past another one
+    changes the distance of a user by +1 or -1, so the distances of all
+    users for all new positions of a movie are cumulative sums over the
+    movies it passes, O(users * n) per movie. A move is taken if it makes
+    the disagreement smaller, or keeps it and makes the sum of the
+    distances smaller (so that the search does not stop on the many orders
+    with the same disagreement). Stops when no move improves or after
+    max_rounds rounds over all movies.
+
+    Args:
+        recommendations_list (list[list[int]]): List of list of user's recommendations.
+        n (int): number of movies to order
+        start (Union[str, list[int]]): initial order, "borda", "copeland" or
+            an order of the movies
+        max_rounds (int): maximum number of rounds
+
+    Returns:
+        Aggregation: the improved order and its disagreement
+
+    Raises:
+        ValueError: If there are not enough common movies in the recommendations
+                    or the start order is unknown or not an order of the movies.
+    """
 
-#     return best_recs_order
+    preferences = PairwisePreferences.from_recommendations(recommendations_list, n)
+    movies = preferences.movies
+    if start == "borda":
+        start = borda_aggregation(recommendations_list, n).order
+    elif start == "copeland":
+        start = copeland_aggregation(recommendations_list, n).order
+    elif isinstance(start, str) or sorted(start) != sorted(movies):
+        raise ValueError("Start order is not an order of the movies")
+    index = {movie: i for i, movie in enumerate(movies)}
+    order = [index[movie] for movie in start]
+
+    # before[u, a, b]: user u ranks movie a before movie b
+    before = preferences.before.astype(np.int64)
+    distances = preferences.distances(np.array(order))
+
+    def objective(distances: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return distances.max(axis=0) - distances.min(axis=0), distances.sum(axis=0)
+
+    best = tuple(int(value) for value in objective(distances[:, np.newaxis]))
+    for _ in range(max_rounds):
+        improved = False
+        for i in range(len(order)):
+            movie = order[i]
+            others = np.array(order)
+            # change of a user's distance when the movie is moved in front of
+            # the movie at k (the opposite when moved behind it)
+            change = before[:, others, movie] - before[:, movie, others]
+
+            # distance changes of moving the movie to every position j
+            moves = np.zeros_like(change)
+            moves[:, :i] = np.cumsum(change[:, :i][:, ::-1], axis=1)[:, ::-1]
+            moves[:, i + 1 :] = -np.cumsum(change[:, i + 1 :], axis=1)
+
+            spread, total = objective(distances[:, np.newaxis] + moves)
+            j = int(np.lexsort((total, spread))[0])
+            if (spread[j], total[j]) < best:
+                best = (int(spread[j]), int(total[j]))
+                distances = distances + moves[:, j]
+                order.insert(j, order.pop(i))
+                improved = True
+        if not improved:
+            break
+
+    return Aggregation([movies[i] for i in order], best[0])
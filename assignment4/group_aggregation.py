@@ -0,0 +1,282 @@
+"""
+DATA.ML.360 Recommender Systems
+Group aggregation on a dense (group members x candidate movies) score matrix.
+
+Every aggregation strategy is a function that reduces the score matrix into
+one group score per movie, so a new strategy is a new reduction instead of
+a new loop over the movies.
+
+Antti Pham, Sophie Tötterström
+"""
+
+from typing import Callable, Union
+
+import numpy as np
+from scipy import stats
+
+import assignment1 as asg1
+
+# Reduces a (members x movies) score matrix into group scores of the movies
+Strategy = Callable[[np.ndarray], np.ndarray]
+
+
+class GroupScores:
+    """
+    Scores of the group members for the candidate movies.
+    """
+
+    def __init__(self, members: list[int], movies: np.ndarray, scores: np.ndarray):
+        """
+        Args:
+            members (list[int]): user_id of each row
+            movies (np.ndarray): movie_id of each column
+            scores (np.ndarray): scores, shape (members, movies)
+        """
+
+        self.members = members
+        self.movies = movies
+        self.scores = scores
+
+    @classmethod
+    def from_recs(
+        cls,
+        user_movie_df: asg1.Ratings,
+        users_recs: dict[int, list[tuple[int, float]]],
+        members: list[int] = None,
+    ) -> "GroupScores":
+        """
+        Build the score matrix of one group from the members' recommendations
+        (see group_scores_many).
+
+        Args:
+            user_movie_df (asg1.Ratings): ratings dataset
+            users_recs (dict[int, list[tuple[int, float]]]): (movie_id, rating)
+                recommendations of the users
+            members (list[int]): group members (the users of users_recs if None)
+
+        Returns:
+            GroupScores: the score matrix
+
+        Raises:
+            ValueError: If a member has neither a prediction nor a rating
+                        for a candidate movie.
+        """
+
+        if members is None:
+            members = list(users_recs)
+        return group_scores_many(user_movie_df, users_recs, [members])[0]
+
+    def aggregate(self, strategy: Union[str, Strategy]) -> np.ndarray:
+        """
+        Group score of every candidate movie.
+
+        Args:
+            strategy (Union[str, Strategy]): name in STRATEGIES or a reduction
+
+        Raises:
+            ValueError: If the strategy name is unknown.
+        """
+
+        if isinstance(strategy, str):
+            if strategy not in STRATEGIES:
+                raise ValueError(f"Unknown aggregation strategy {strategy}")
+            strategy = STRATEGIES[strategy]
+        if not self.members:
+            # a group without members has no candidates to reduce
+            return np.zeros(0)
+        return strategy(self.scores)
+
+    def as_dict(self, strategy: Union[str, Strategy]) -> dict[int, float]:
+        """
+        Group scores as movie_id -> score in the candidate order.
+        """
+
+        return dict(zip(self.movies.tolist(), self.aggregate(strategy).tolist()))
+
+    def ranking(self, strategy: Union[str, Strategy]) -> list[tuple[int, float]]:
+        """
+        (movie_id, group score) pairs in descending order, ties in the
+        candidate order.
+        """
+
+        group_scores = self.aggregate(strategy)
+        order = np.argsort(-group_scores, kind="stable")
+        return list(zip(self.movies[order].tolist(), group_scores[order].tolist()))
+
+
+def group_scores_many(
+    user_movie_df: asg1.Ratings,
+    users_recs: dict[int, list[tuple[int, float]]],
+    groups: list[list[int]],
+) -> list[GroupScores]:
+    """
+    Build the score matrices of many groups at once.
+
+    The candidates of a group are the movies recommended to any member, in
+    the order they first appear in the members' recommendations. A member's
+    score for a movie is the predicted rating in its recommendations, or the
+    real rating if the movie was not recommended to the member.
+
+    The recommendations and the real ratings of every user are converted
+    into arrays only once, so groups with common members share them, and
+    every group gets a score matrix over its own candidates only.
+
+    Args:
+        user_movie_df (asg1.Ratings): ratings dataset
+        users_recs (dict[int, list[tuple[int, float]]]): (movie_id, rating)
+            recommendations of the users (members without recommendations
+            are scored with their real ratings only)
+        groups (list[list[int]]): members of every group
+
+    Returns:
+        list[GroupScores]: score matrix of every group, in the order of groups
+            (a group without members has no candidates)
+
+    Raises:
+        ValueError: If a member has neither a prediction nor a rating for a
+                    candidate movie of its group.
+    """
+
+    # recommendations and real ratings (only read if needed) of every user
+    recs: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+    ratings: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+
+    all_scores = []
+    for group in groups:
+        if not group:
+            # a group without members has no candidates
+            empty = GroupScores([], np.zeros(0, dtype=np.int64), np.zeros((0, 0)))
+            all_scores.append(empty)
+            continue
+        for member in group:
+            if member not in recs:
+                recs[member] = _rec_arrays(users_recs.get(member, []))
+
+        # column of every recommendation in the group's sorted candidates,
+        # which are then put in the order of first appearance
+        movies = np.concatenate([recs[member][0] for member in group])
+        candidates, first, columns = np.unique(
+            movies, return_index=True, return_inverse=True
+        )
+        order = np.argsort(first)
+
+        # predictions first (the last one of a duplicate movie), then real
+        # ratings for the movies not recommended
+        scores = np.full((len(group), len(candidates)), np.nan)
+        start = 0
+        for row, member in enumerate(group):
+            member_scores = recs[member][1]
+            end = start + len(member_scores)
+            scores[row, columns[start:end]] = member_scores
+            start = end
+            missing = np.flatnonzero(np.isnan(scores[row]))
+            if len(missing) == 0:
+                continue
+            if member not in ratings:
+                ratings[member] = _sorted_ratings(user_movie_df, member)
+            found, values = _lookup(*ratings[member], candidates[missing])
+            scores[row, missing[found]] = values
+
+        if np.isnan(scores).any():
+            raise ValueError("Movie not found")
+        all_scores.append(GroupScores(list(group), candidates[order], scores[:, order]))
+    return all_scores
+
+
+def _rec_arrays(user_recs: list[tuple[int, float]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Movie ids and predictions of the recommendations as arrays.
+    """
+
+    movies, scores = zip(*user_recs) if user_recs else ((), ())
+    return np.array(movies, dtype=np.int64), np.array(scores, dtype=np.float64)
+
+
+def _sorted_ratings(
+    user_movie_df: asg1.Ratings, user_id: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Movie ids and real ratings of a user, sorted by movie id.
+    """
+
+    user_ratings = asg1.get_user_data(user_movie_df, user_id).iloc[:, 0]
+    movies = user_ratings.index.to_numpy(dtype=np.int64)
+    order = np.argsort(movies, kind="stable")
+    return movies[order], user_ratings.to_numpy(dtype=np.float64)[order]
+
+
+def _lookup(
+    movies: np.ndarray, values: np.ndarray, candidates: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Positions of the candidates that are in the sorted movies, and their
+    values (the last one of a duplicate movie).
+    """
+
+    if len(movies) == 0:
+        return np.zeros(0, dtype=np.int64), values
+    pos = np.maximum(np.searchsorted(movies, candidates, side="right") - 1, 0)
+    found = np.flatnonzero(movies[pos] == candidates)
+    return found, values[pos[found]]
+
+
+def average(scores: np.ndarray) -> np.ndarray:
+    """
+    Mean score of the members.
+    """
+
+    return scores.sum(axis=0) / len(scores)
+
+
+def least_misery(scores: np.ndarray) -> np.ndarray:
+    """
+    Score of the least satisfied member.
+    """
+
+    return scores.min(axis=0)
+
+
+def most_pleasure(scores: np.ndarray) -> np.ndarray:
+    """
+    Score of the most satisfied member.
+    """
+
+    return scores.max(axis=0)
+
+
+def borda(scores: np.ndarray) -> np.ndarray:
+    """
+    Borda count: every member gives each movie as many points as there are
+    movies it scores lower (tied movies share the points).
+    """
+
+    return (stats.rankdata(scores, axis=1) - 1).sum(axis=0)
+
+
+def weighted(weights: dict[str, float]) -> Strategy:
+    """
+    Hybrid strategy: weighted sum of other strategies, e.g.
+    weighted({"average": 1 - alpha, "least_misery": alpha}).
+
+    Raises:
+        ValueError: If a strategy name is unknown.
+    """
+
+    unknown = set(weights) - set(STRATEGIES)
+    if unknown:
+        raise ValueError(f"Unknown aggregation strategies {sorted(unknown)}")
+
+    def hybrid(scores: np.ndarray) -> np.ndarray:
+        return sum(
+            weight * STRATEGIES[name](scores) for name, weight in weights.items()
+        )
+
+    return hybrid
+
+
+STRATEGIES: dict[str, Strategy] = {
+    "average": average,
+    "least_misery": least_misery,
+    "most_pleasure": most_pleasure,
+    "borda": borda,
+}
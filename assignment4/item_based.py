@@ -0,0 +1,296 @@
+"""
+DATA.ML.360 Recommender Systems
+Item-based collaborative filtering.
+
+Movie-movie similarities change slowly when there are many more users than
+movies, so the most similar movies of every movie are computed once into a
+neighbor table that can be saved and reused. A prediction for a user only
+reads the rows of the table of the movies the user has rated.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import json
+import os
+
+import numpy as np
+
+import assignment1 as asg1
+import similarity
+from cache import LRUCache
+from ratings_store import RatingsStore
+
+N_NEIGHBORS = 50
+
+
+def item_rating_values(store: RatingsStore, similarity_type: str) -> np.ndarray:
+    """
+    Rating values used by the item similarity type, in the order of
+    store.csr.data: the ratings for cosine, the ratings centered by the
+    user's mean for adjusted cosine and by the movie's mean for pearson.
+    """
+
+    if similarity_type == "adjusted_cosine":
+        return store.centered().data
+
+    ratings = store.decode(store.csr.data)
+    if similarity_type == "cosine":
+        return ratings
+
+    cols = store.csr.indices
+    counts = np.bincount(cols, minlength=store.shape[1])
+    sums = np.bincount(cols, weights=ratings, minlength=store.shape[1])
+    means = np.divide(sums, counts, out=np.zeros(len(sums)), where=counts > 0)
+    return ratings - means[cols]
+
+
+class ItemNeighbors:
+    """
+    The most similar movies of every movie, for one similarity type.
+
+    Similarities are computed like the user similarities in similarity.py
+    (sums over the common users only, 0 with less than 3 common users), with
+    the movies in place of the users. Only positive similarities are kept,
+    rows with less than n_neighbors of them are padded with -1. The
+    fingerprint of the ratings (RatingsStore.fingerprint) is saved with the
+    table, so a table of older ratings is not reused.
+    """
+
+    def __init__(
+        self,
+        movie_ids: np.ndarray,
+        similarity_type: str,
+        neighbors: np.ndarray,
+        neighbor_sims: np.ndarray,
+        ratings_fingerprint: str = None,
+    ):
+        """
+        Args:
+            movie_ids (np.ndarray): movie_id of each row (same order as the store)
+            similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+            neighbors (np.ndarray): columns of the most similar movies of each
+                                    movie in descending similarity order
+            neighbor_sims (np.ndarray): similarities of the neighbors
+            ratings_fingerprint (str): fingerprint of the ratings the table
+                has been computed from (None if unknown)
+        """
+
+        self.movie_ids = movie_ids
+        self.similarity_type = similarity_type
+        self.neighbors = neighbors
+        self.neighbor_sims = neighbor_sims
+        self.ratings_fingerprint = ratings_fingerprint
+
+    @classmethod
+    def build(
+        cls,
+        store: RatingsStore,
+        similarity_type: str = "pearson",
+        n_neighbors: int = N_NEIGHBORS,
+        block_size: int = 256,
+    ) -> "ItemNeighbors":
+        """
+        Compute the neighbor table in blocks of block_size movies.
+
+        Args:
+            store (RatingsStore): ratings
+            similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+            n_neighbors (int): length of the neighbor table of each movie
+            block_size (int): number of movies computed at once
+
+        Returns:
+            ItemNeighbors: the neighbor table
+
+        Raises:
+            ValueError: If the similarity type is unknown.
+        """
+
+        if similarity_type not in similarity.SIMILARITY_TYPES:
+            raise ValueError(f"Unknown similarity type {similarity_type}")
+
+        # movies as rows and users as columns
+        positions = similarity.transpose_positions(store.csr)
+        values = item_rating_values(store, similarity_type)[positions.data]
+        operands = similarity.csr_operands(positions, values)
+
+        n_movies = store.shape[1]
+        n_neighbors = min(n_neighbors, n_movies - 1)
+        neighbors = np.full((n_movies, n_neighbors), -1, dtype=np.int32)
+        neighbor_sims = np.zeros((n_movies, n_neighbors))
+        for start in range(0, n_movies, block_size):
+            end = min(start + block_size, n_movies)
+            block = similarity.similarity_rows(operands, slice(start, end))
+            for col in range(start, end):
+                sims = block[col - start]
+                order = similarity.top_k(sims, n_neighbors, exclude=col)
+                order = order[sims[order] > 0]
+                neighbors[col, : len(order)] = order
+                neighbor_sims[col, : len(order)] = sims[order]
+
+        return cls(
+            store.movie_ids,
+            similarity_type,
+            neighbors,
+            neighbor_sims,
+            store.fingerprint(),
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Save the neighbor table into the directory path.
+        """
+
+        os.makedirs(path, exist_ok=True)
+        for name in ("movie_ids", "neighbors", "neighbor_sims"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            "similarity_type": self.similarity_type,
+            "ratings_fingerprint": self.ratings_fingerprint,
+        }
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(meta, file)
+
+    @classmethod
+    def load(cls, path: str) -> "ItemNeighbors":
+        """
+        Load a neighbor table saved with save.
+        """
+
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"))
+            for name in ("movie_ids", "neighbors", "neighbor_sims")
+        }
+        return cls(
+            similarity_type=meta["similarity_type"],
+            ratings_fingerprint=meta.get("ratings_fingerprint"),
+            **arrays,
+        )
+
+    def matches(self, store: RatingsStore) -> bool:
+        """
+        Check that the table has been computed from the ratings of the store.
+        """
+
+        return (
+            np.array_equal(self.movie_ids, store.movie_ids)
+            and self.ratings_fingerprint == store.fingerprint()
+        )
+
+    def predict_user(self, store: RatingsStore, user_id: int) -> np.ndarray:
+        """
+        Predict the ratings of a user for all movies.
+
+        The prediction for a movie is the similarity weighted mean of the
+        user's ratings of the movies that have it as a neighbor, and 0 when
+        there are none. Only the table rows of the rated movies are read.
+
+        Args:
+            store (RatingsStore): ratings
+            user_id (int): active user
+
+        Returns:
+            np.ndarray: predicted rating for every movie (column of the store)
+        """
+
+        row = store.user_index[user_id]
+        start, end = store.csr.indptr[row], store.csr.indptr[row + 1]
+        cols = store.csr.indices[start:end]
+        ratings = store.decode(store.csr.data[start:end])
+        neighbors = self.neighbors[cols]
+        sims = self.neighbor_sims[cols]
+        valid = neighbors >= 0
+
+        n_movies = len(self.movie_ids)
+        weighted = (sims * ratings[:, np.newaxis])[valid]
+        numerator = np.bincount(neighbors[valid], weighted, minlength=n_movies)
+        denominator = np.bincount(neighbors[valid], sims[valid], minlength=n_movies)
+
+        predictions = np.zeros(n_movies)
+        predicted = denominator > 0
+        predictions[predicted] = numerator[predicted] / denominator[predicted]
+        return predictions
+
+
+def load_or_build_neighbors(
+    store: RatingsStore, similarity_type: str, path: str = None
+) -> ItemNeighbors:
+    """
+    Load the neighbor table saved in path, or build it (and save it if path
+    is given) if it does not exist or has been computed from other ratings
+    or for another similarity type.
+    """
+
+    if path is not None and os.path.exists(os.path.join(path, "meta.json")):
+        item_neighbors = ItemNeighbors.load(path)
+        if (
+            item_neighbors.similarity_type == similarity_type
+            and item_neighbors.matches(store)
+        ):
+            return item_neighbors
+
+    item_neighbors = ItemNeighbors.build(store, similarity_type)
+    if path is not None:
+        item_neighbors.save(path)
+    return item_neighbors
+
+
+def get_top_movies(
+    user_movie_df: asg1.Ratings,
+    user_id: int,
+    similarity_type="pearson",
+    item_neighbors: ItemNeighbors = None,
+    missing: str = "zero",
+    cache: LRUCache = None,
+) -> list[tuple[int, float]]:
+    """
+    Returns matching movies for a given user with item-based filtering.
+    Same contract as asg1.get_top_movies: the movies with their predicted
+    ratings in descending order, ties in the movie id order. With a cache,
+    the result is memoized like in asg1.get_top_movies.
+
+    Args:
+        user_movie_df (asg1.Ratings): ratings dataset
+        user_id (int): active user
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+        item_neighbors (ItemNeighbors): precomputed neighbor table
+                                        (computed if None)
+        missing (str): "zero" to list the movies without a prediction with
+                       the prediction 0, "omit" to leave them out
+        cache (LRUCache): cache of recommendations (see asg1.cached)
+
+    Returns:
+        list[tuple[int, float]]: (movie_id, predicted rating) pairs
+
+    Raises:
+        ValueError: If the neighbor table is for another similarity type or
+                    the missing policy is unknown.
+    """
+
+    if missing not in asg1.MISSING_POLICIES:
+        raise ValueError(f"Unknown missing policy {missing}")
+
+    store = asg1.as_ratings_store(user_movie_df)
+    if item_neighbors is None:
+        item_neighbors = ItemNeighbors.build(store, similarity_type)
+    elif item_neighbors.similarity_type != similarity_type:
+        raise ValueError(
+            f"Neighbor table is for {item_neighbors.similarity_type} "
+            f"similarity, not {similarity_type}"
+        )
+
+    def compute() -> list[tuple[int, float]]:
+        movies = store.movie_ids.astype(int)
+        ratings = item_neighbors.predict_user(store, user_id)
+        if missing == "omit":
+            # predictions are weighted means of ratings, so only missing ones are 0
+            movies, ratings = movies[ratings != 0], ratings[ratings != 0]
+
+        # sort in descending order, ties keep the movie id order
+        order = np.argsort(-ratings, kind="stable")
+        return list(zip(movies[order].tolist(), ratings[order].tolist()))
+
+    n_neighbors = item_neighbors.neighbors.shape[1]
+    key = ("item_top_movies", user_id, similarity_type, n_neighbors, missing)
+    return asg1.cached(cache, key, store, compute)
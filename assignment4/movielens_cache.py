@@ -0,0 +1,208 @@
+"""
+DATA.ML.360 Recommender Systems
+Binary cache of the MovieLens csv files.
+
+On the first run ratings.csv and movies.csv are converted into compact
+columnar .npy files next to the csv file. Later runs memory-map those files
+instead of parsing the csv again. The cache is rebuilt when the size or the
+modification time of the csv file changes.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ratings_store import RatingsStore
+
+# Increase when the layout of the cache files changes
+CACHE_VERSION = 1
+
+
+def cache_dir_for(csv_path: str) -> str:
+    """
+    Default cache directory of a csv file, e.g. ratings.csv -> ratings.csv.cache
+    """
+
+    return csv_path + ".cache"
+
+
+def _source_info(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def is_valid(csv_path: str, cache_dir: str) -> bool:
+    """
+    Check that the cache exists and was built from the current csv file.
+    """
+
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as file:
+        return json.load(file) == _source_info(csv_path)
+
+
+def _start_writing(cache_dir: str) -> None:
+    # meta.json is written last, so a half written cache is never valid
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.makedirs(cache_dir)
+
+
+def _finish_writing(csv_path: str, cache_dir: str) -> None:
+    with open(os.path.join(cache_dir, "meta.json"), "w") as file:
+        json.dump(_source_info(csv_path), file)
+
+
+def _load(cache_dir: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r")
+
+
+def _save(cache_dir: str, name: str, array: np.ndarray) -> None:
+    np.save(os.path.join(cache_dir, f"{name}.npy"), array)
+
+
+def build_ratings_cache(csv_path: str, cache_dir: str) -> None:
+    """
+    Convert ratings.csv into the binary cache.
+
+    The ratings are sorted by user and movie and stored in CSR layout:
+    int32 movie indices, float32 ratings and int32 timestamps, plus the
+    int32 user and movie id maps and the row pointers.
+    """
+
+    ratings = pd.read_csv(
+        csv_path,
+        dtype={
+            "userId": np.int32,
+            "movieId": np.int32,
+            "rating": np.float32,
+            "timestamp": np.int64,
+        },
+    )
+    user_ids, rows = np.unique(ratings["userId"].to_numpy(), return_inverse=True)
+    movie_ids, cols = np.unique(ratings["movieId"].to_numpy(), return_inverse=True)
+    order = np.lexsort((cols, rows))
+
+    index_dtype = np.int32 if len(ratings) < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(len(user_ids) + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(rows, minlength=len(user_ids)), out=indptr[1:])
+
+    _start_writing(cache_dir)
+    _save(cache_dir, "user_ids", user_ids.astype(np.int32))
+    _save(cache_dir, "movie_ids", movie_ids.astype(np.int32))
+    _save(cache_dir, "indptr", indptr)
+    _save(cache_dir, "indices", cols[order].astype(index_dtype))
+    _save(cache_dir, "ratings", ratings["rating"].to_numpy()[order])
+    _save(
+        cache_dir,
+        "timestamps",
+        ratings["timestamp"].to_numpy()[order].astype(np.int32),
+    )
+    _finish_writing(csv_path, cache_dir)
+
+
+def load_ratings(
+    csv_path: str, cache_dir: str = None, compact: bool = False
+) -> RatingsStore:
+    """
+    Load ratings.csv as a RatingsStore through the binary cache.
+    The cache is (re)built first if it is missing or out of date.
+
+    Args:
+        csv_path (str): path to ratings.csv
+        cache_dir (str): cache directory (next to the csv file if None)
+        compact (bool): encode the ratings as 8-bit codes in memory instead
+            of memory-mapping the float32 ratings
+
+    Returns:
+        RatingsStore: ratings backed by the memory-mapped cache files
+    """
+
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    if not is_valid(csv_path, cache_dir):
+        build_ratings_cache(csv_path, cache_dir)
+
+    user_ids = _load(cache_dir, "user_ids")
+    movie_ids = _load(cache_dir, "movie_ids")
+    csr = sparse.csr_matrix(
+        (
+            _load(cache_dir, "ratings"),
+            _load(cache_dir, "indices"),
+            _load(cache_dir, "indptr"),
+        ),
+        shape=(len(user_ids), len(movie_ids)),
+        copy=False,
+    )
+    store = RatingsStore(user_ids, movie_ids, csr)
+    return store.to_compact() if compact else store
+
+
+def _save_strings(cache_dir: str, name: str, strings: pd.Series) -> None:
+    # utf-8 bytes of all strings after each other and the offsets of each one
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    _save(cache_dir, f"{name}_data", np.frombuffer(b"".join(encoded), np.uint8))
+    _save(cache_dir, f"{name}_offsets", offsets)
+
+
+def _load_strings(cache_dir: str, name: str) -> list[str]:
+    data = _load(cache_dir, f"{name}_data").tobytes()
+    offsets = _load(cache_dir, f"{name}_offsets")
+    return [
+        data[start:end].decode("utf-8")
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def build_movies_cache(csv_path: str, cache_dir: str) -> None:
+    """
+    Convert movies.csv into the binary cache: int32 movie ids and the titles
+    and genres as utf-8 strings.
+    """
+
+    movies = pd.read_csv(csv_path, dtype={"movieId": np.int32})
+
+    _start_writing(cache_dir)
+    _save(cache_dir, "movie_ids", movies["movieId"].to_numpy())
+    _save_strings(cache_dir, "titles", movies["title"])
+    _save_strings(cache_dir, "genres", movies["genres"])
+    _finish_writing(csv_path, cache_dir)
+
+
+def load_movies(csv_path: str, cache_dir: str = None) -> pd.DataFrame:
+    """
+    Load movies.csv through the binary cache.
+    The cache is (re)built first if it is missing or out of date.
+
+    Args:
+        csv_path (str): path to movies.csv
+        cache_dir (str): cache directory (next to the csv file if None)
+
+    Returns:
+        pd.DataFrame: movie-genre dataframe indexed by movieId
+    """
+
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    if not is_valid(csv_path, cache_dir):
+        build_movies_cache(csv_path, cache_dir)
+
+    return pd.DataFrame(
+        {
+            "title": _load_strings(cache_dir, "titles"),
+            "genres": _load_strings(cache_dir, "genres"),
+        },
+        index=pd.Index(np.asarray(_load(cache_dir, "movie_ids")), name="movieId"),
+    )
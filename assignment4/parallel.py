@@ -0,0 +1,280 @@
+"""
+DATA.ML.360 Recommender Systems
+Parallel user similarity calculations on a process pool.
+
+The sparse matrices of the similarity calculation are written once into
+.npy files that every worker process memory-maps, so the ratings are shared
+through the page cache instead of being pickled to the workers. The users
+are split into many small tasks with about the same number of ratings, and
+the pool hands the tasks out to the workers as they become free, so long
+rows don't leave the other workers waiting.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import os
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import sparse
+
+import similarity
+from ratings_store import RatingsStore
+
+# Tasks per process, more tasks balance the load better but add overhead
+TASKS_PER_PROCESS = 8
+
+# Set in every worker process by _init_worker
+_operands: similarity.SimilarityOperands = None
+_outputs: dict[str, np.ndarray] = {}
+
+
+def _share_operands(operands: similarity.SimilarityOperands, dir_path: str) -> dict:
+    """
+    Save the arrays of the operands into dir_path, each array only once
+    (the matrices share their index arrays).
+
+    Returns:
+        dict: matrix name -> (file of data, indices and indptr, shape)
+    """
+
+    files: dict[int, str] = {}
+    layout = {}
+    for name, matrix in operands._asdict().items():
+        parts = []
+        for array in (matrix.data, matrix.indices, matrix.indptr):
+            if id(array) not in files:
+                files[id(array)] = os.path.join(dir_path, f"{len(files)}.npy")
+                np.save(files[id(array)], array)
+            parts.append(files[id(array)])
+        layout[name] = (parts, matrix.shape)
+    return layout
+
+
+def _attach_operands(layout: dict) -> similarity.SimilarityOperands:
+    """
+    Memory-map the operands saved by _share_operands.
+    """
+
+    matrices = {}
+    for name, (parts, shape) in layout.items():
+        data, indices, indptr = (np.load(part, mmap_mode="r") for part in parts)
+        matrices[name] = sparse.csr_matrix(
+            (data, indices, indptr), shape=shape, copy=False
+        )
+    return similarity.SimilarityOperands(**matrices)
+
+
+def _init_worker(layout: dict, output_paths: dict[str, str]) -> None:
+    global _operands, _outputs
+
+    _operands = _attach_operands(layout)
+    _outputs = {
+        name: np.load(path, mmap_mode="r+") for name, path in output_paths.items()
+    }
+
+
+def _neighbors(
+    sims: np.ndarray, rows: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k neighbors of every row of a similarity block (see similarity.top_k).
+    """
+
+    neighbors = np.empty((len(rows), k), dtype=np.int32)
+    neighbor_sims = np.empty((len(rows), k))
+    for i, row in enumerate(rows):
+        order = similarity.top_k(sims[i], k, exclude=row)
+        neighbors[i] = order
+        neighbor_sims[i] = sims[i, order]
+    return neighbors, neighbor_sims
+
+
+def _neighbors_task(
+    task: tuple[np.ndarray, int],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rows, k = task
+    sims = similarity.similarity_rows(_operands, rows)
+    return (rows, *_neighbors(sims, rows, k))
+
+
+def _matrix_task(task: tuple[np.ndarray, int]) -> None:
+    rows, k = task
+    start, end = rows[0], rows[-1] + 1
+    sims = similarity.similarity_rows(_operands, slice(start, end))
+    _outputs["sims"][start:end] = sims
+    neighbors, neighbor_sims = _neighbors(sims, rows, k)
+    _outputs["neighbors"][start:end] = neighbors
+    _outputs["neighbor_sims"][start:end] = neighbor_sims
+
+
+def _tasks(
+    store: RatingsStore, rows: np.ndarray, processes: int, max_rows: int
+) -> list[np.ndarray]:
+    """
+    Split the rows into consecutive tasks of about the same number of
+    ratings and at most max_rows rows. The largest tasks come first, so
+    that no long task is left running alone at the end.
+    """
+
+    counts = np.diff(store.csr.indptr)[rows] + 1
+    target = max(1, counts.sum() // (processes * TASKS_PER_PROCESS))
+
+    # (number of ratings, rows) of each task
+    tasks = []
+    start = 0
+    total = 0
+    for end, count in enumerate(counts, start=1):
+        total += count
+        if total >= target or end - start == max_rows or end == len(rows):
+            tasks.append((total, rows[start:end]))
+            start = end
+            total = 0
+
+    tasks.sort(key=lambda task: -task[0])
+    return [task_rows for _, task_rows in tasks]
+
+
+def _run(task_function, tasks: list, processes: int, layout: dict, outputs: dict):
+    """
+    Run the tasks in a pool of processes and yield the results in the order
+    they are finished. With one process the tasks are run in this process.
+    """
+
+    global _operands, _outputs
+
+    if processes == 1:
+        _init_worker(layout, outputs)
+        try:
+            for task in tasks:
+                yield task_function(task)
+        finally:
+            _operands, _outputs = None, {}
+        return
+
+    with Pool(processes, _init_worker, (layout, outputs)) as pool:
+        # chunksize 1: a free worker takes the next task
+        yield from pool.imap_unordered(task_function, tasks, chunksize=1)
+
+
+def similar_users_many(
+    store: RatingsStore,
+    user_ids: list[int] = None,
+    similarity_type: str = "pearson",
+    k: int = None,
+    processes: int = None,
+    block_size: int = 256,
+) -> dict[int, list[tuple[int, float]]]:
+    """
+    Similar users of many users in parallel. Gives the same result as
+    asg1.get_similar_users for each user.
+
+    Args:
+        store (RatingsStore): ratings
+        user_ids (list[int]): active users (all users if None)
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+        k (int): number of most similar users (all users if None)
+        processes (int): number of worker processes (number of cores if None)
+        block_size (int): maximum number of users computed at once in a task
+
+    Returns:
+        dict[int, list[tuple[int, float]]]: user_id -> (user_id, similarity)
+                                            pairs in descending order
+    """
+
+    processes = processes or os.cpu_count()
+    n_users = store.shape[0]
+    k = n_users - 1 if k is None else min(k, n_users - 1)
+    if user_ids is None:
+        user_ids = store.user_ids.tolist()
+    rows = np.array(sorted({store.user_index[user] for user in user_ids}), dtype=int)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as dir_path:
+        layout = _share_operands(
+            similarity.similarity_operands(store, similarity_type), dir_path
+        )
+        tasks = [(task, k) for task in _tasks(store, rows, processes, block_size)]
+        for task_rows, neighbors, neighbor_sims in _run(
+            _neighbors_task, tasks, processes, layout, {}
+        ):
+            for row, users, sims in zip(task_rows, neighbors, neighbor_sims):
+                results[int(store.user_ids[row])] = list(
+                    zip(store.user_ids[users].tolist(), sims.tolist())
+                )
+    return {user: results[user] for user in user_ids}
+
+
+def build_similarity_matrix(
+    store: RatingsStore,
+    similarity_type: str = "pearson",
+    path: str = None,
+    processes: int = None,
+    block_size: int = 256,
+    n_neighbors: int = 100,
+) -> similarity.SimilarityMatrix:
+    """
+    Compute the similarity matrix in parallel. Gives the same matrix as
+    SimilarityMatrix.build.
+
+    The workers write their rows straight into memory-mapped result files,
+    in path or in a temporary directory (then the result is read into memory).
+
+    Args:
+        store (RatingsStore): ratings
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+        path (str): directory to save the matrix in (kept in memory if None)
+        processes (int): number of worker processes (number of cores if None)
+        block_size (int): maximum number of users computed at once in a task
+        n_neighbors (int): length of the sorted neighbor table of each user
+
+    Returns:
+        SimilarityMatrix: the computed matrix
+
+    Raises:
+        ValueError: If the similarity type is unknown.
+    """
+
+    if similarity_type not in similarity.SIMILARITY_TYPES:
+        raise ValueError(f"Unknown similarity type {similarity_type}")
+
+    processes = processes or os.cpu_count()
+    n_users = store.shape[0]
+    n_neighbors = min(n_neighbors, n_users - 1)
+    shapes = {
+        "sims": ((n_users, n_users), np.float64),
+        "neighbors": ((n_users, n_neighbors), np.int32),
+        "neighbor_sims": ((n_users, n_neighbors), np.float64),
+    }
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        output_dir = dir_path if path is None else path
+        os.makedirs(output_dir, exist_ok=True)
+        outputs = {name: os.path.join(output_dir, f"{name}.npy") for name in shapes}
+        arrays = {
+            name: np.lib.format.open_memmap(outputs[name], "w+", dtype, shape)
+            for name, (shape, dtype) in shapes.items()
+        }
+
+        layout = _share_operands(
+            similarity.similarity_operands(store, similarity_type), dir_path
+        )
+        rows = np.arange(n_users)
+        tasks = [
+            (task, n_neighbors) for task in _tasks(store, rows, processes, block_size)
+        ]
+        for _ in _run(_matrix_task, tasks, processes, layout, outputs):
+            pass
+
+        if path is None:
+            arrays = {name: np.array(array) for name, array in arrays.items()}
+        matrix = similarity.SimilarityMatrix(
+            store.user_ids,
+            similarity_type,
+            **arrays,
+            ratings_fingerprint=store.fingerprint(),
+        )
+    if path is not None:
+        matrix.save(path)
+    return matrix
@@ -0,0 +1,651 @@
+"""
+DATA.ML.360 Recommender Systems
+Sparse storage for the MovieLens user-movie ratings.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import hashlib
+import itertools
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# MovieLens ratings are half stars, so compact stores keep rating / 0.5
+# as an 8-bit code
+RATING_STEP = 0.5
+MAX_RATING_CODE = np.iinfo(np.uint8).max
+
+# Data versions are unique over all stores, so a (store, version) pair
+# never repeats and versions can be used in cache keys
+_versions = itertools.count()
+
+
+def encode_ratings(ratings: np.ndarray) -> np.ndarray:
+    """
+    Encode ratings as uint8 codes (rating / RATING_STEP).
+
+    Raises:
+        ValueError: If a rating is not a multiple of RATING_STEP or does not
+                    fit in 8 bits.
+    """
+
+    codes = np.asarray(ratings, dtype=np.float64) / RATING_STEP
+    rounded = np.rint(codes)
+    if (
+        np.any(rounded != codes)
+        or np.any(rounded < 0)
+        or np.any(rounded > MAX_RATING_CODE)
+    ):
+        raise ValueError(
+            f"Ratings must be multiples of {RATING_STEP} up to "
+            f"{MAX_RATING_CODE * RATING_STEP} to be stored as codes"
+        )
+    return rounded.astype(np.uint8)
+
+
+class UserStats:
+    """
+    Rating statistics of every user, indexed by the store row.
+
+    Computed once when the store is built, so the similarity and prediction
+    functions don't need to rescan the users' ratings.
+    """
+
+    def __init__(self, store: "RatingsStore"):
+        """
+        Args:
+            store (RatingsStore): ratings
+        """
+
+        n_users = store.shape[0]
+        self.count = np.zeros(n_users, dtype=np.int64)
+        self.mean = np.zeros(n_users)
+        # L2 norm of the mean-centered ratings
+        self.norm = np.zeros(n_users)
+        self.min = np.full(n_users, np.nan)
+        self.max = np.full(n_users, np.nan)
+        self.update(store, np.arange(n_users))
+
+    def grow(self, n_users: int) -> None:
+        """
+        Add rows with the statistics of a user without ratings for new users.
+        """
+
+        added = n_users - len(self.count)
+        self.count = np.concatenate([self.count, np.zeros(added, dtype=np.int64)])
+        self.mean = np.concatenate([self.mean, np.zeros(added)])
+        self.norm = np.concatenate([self.norm, np.zeros(added)])
+        self.min = np.concatenate([self.min, np.full(added, np.nan)])
+        self.max = np.concatenate([self.max, np.full(added, np.nan)])
+
+    def set_row(self, row: int, values: np.ndarray) -> None:
+        """
+        Set the statistics of one row from its ratings after they have changed.
+        """
+
+        self.count[row] = len(values)
+        self.mean[row] = 0.0
+        self.norm[row] = 0.0
+        self.min[row] = np.nan
+        self.max[row] = np.nan
+        if len(values):
+            # summed like in update
+            mean = np.add.reduceat(values, [0])[0] / len(values)
+            self.mean[row] = mean
+            self.norm[row] = np.sqrt(np.add.reduceat((values - mean) ** 2, [0])[0])
+            self.min[row] = values.min()
+            self.max[row] = values.max()
+
+    def update(self, store: "RatingsStore", rows: np.ndarray) -> None:
+        """
+        Recompute the statistics of the given rows, e.g. after their
+        ratings have changed.
+        """
+
+        csr = store.csr
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = csr.indptr[rows + 1] - csr.indptr[rows]
+        self.count[rows] = counts
+        self.mean[rows] = 0.0
+        self.norm[rows] = 0.0
+        self.min[rows] = np.nan
+        self.max[rows] = np.nan
+
+        # users without ratings keep the defaults above
+        rows = rows[counts > 0]
+        counts = counts[counts > 0]
+        if len(rows) == 0:
+            return
+
+        # ratings of the rows one after another, and the start of each row
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        positions = np.repeat(csr.indptr[rows] - starts, counts)
+        positions += np.arange(counts.sum())
+        values = store.decode(csr.data[positions])
+
+        means = np.add.reduceat(values, starts) / counts
+        centered = values - np.repeat(means, counts)
+        self.mean[rows] = means
+        self.norm[rows] = np.sqrt(np.add.reduceat(centered**2, starts))
+        self.min[rows] = np.minimum.reduceat(values, starts)
+        self.max[rows] = np.maximum.reduceat(values, starts)
+
+    def to_frame(self, user_ids: np.ndarray) -> pd.DataFrame:
+        """
+        Statistics as a dataframe indexed by userId.
+        """
+
+        return pd.DataFrame(
+            {
+                "count": self.count,
+                "mean": self.mean,
+                "norm": self.norm,
+                "min": self.min,
+                "max": self.max,
+            },
+            index=pd.Index(user_ids, name="userId"),
+        )
+
+
+class RatingsStore:
+    """
+    Sparse user-movie ratings matrix of the MovieLens dataset.
+
+    The ratings are kept in CSR (rows are users) and CSC (columns are movies)
+    format, so memory grows with the number of ratings instead of the number
+    of users times the number of movies. MovieLens ids are mapped to compact
+    row and column indices, which are assigned in ascending id order (the same
+    order as in the pivoted dataframe).
+
+    A compact store keeps the ratings as 8-bit codes (see encode_ratings)
+    instead of float64 values, which takes 5 bytes per rating instead of 12
+    together with the int32 movie index. The codes are decoded only for the
+    rows a calculation uses (see decode).
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        movie_ids: np.ndarray,
+        csr: sparse.csr_matrix,
+    ):
+        """
+        Args:
+            user_ids (np.ndarray): user_id of each row
+            movie_ids (np.ndarray): movie_id of each column
+            csr (sparse.csr_matrix): ratings, shape (len(user_ids), len(movie_ids))
+        """
+
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+        self._csr = csr
+        self._csr.sort_indices()
+        self.compact = csr.dtype == np.uint8
+
+        # user_id -> row index, movie_id -> column index
+        self.user_index: dict[int, int] = {
+            int(user_id): idx for idx, user_id in enumerate(user_ids)
+        }
+        self.movie_index: dict[int, int] = {
+            int(movie_id): idx for idx, movie_id in enumerate(movie_ids)
+        }
+
+        self._csc: sparse.csc_matrix = None
+        # changes that are not merged into the CSR matrix yet:
+        # row -> {column: stored value, None for a deleted rating}
+        self._pending: dict[int, dict[int, object]] = {}
+
+        # changed on every change of the ratings
+        self.version = next(_versions)
+        # (version, fingerprint) of the last computed fingerprint
+        self._fingerprint: tuple[int, str] = None
+
+        # mean, centered norm, count, min and max rating of every user
+        self.stats = UserStats(self)
+
+    @classmethod
+    def from_ratings(
+        cls, ratings: pd.DataFrame, compact: bool = False
+    ) -> "RatingsStore":
+        """
+        Build the store from the ratings.csv dataframe.
+
+        Args:
+            ratings (pd.DataFrame): dataframe with userId, movieId and rating columns
+            compact (bool): keep the ratings as 8-bit codes and the ids as int32
+
+        Returns:
+            RatingsStore: sparse ratings store
+        """
+
+        user_ids, rows = np.unique(ratings["userId"].to_numpy(), return_inverse=True)
+        movie_ids, cols = np.unique(ratings["movieId"].to_numpy(), return_inverse=True)
+        values = ratings["rating"].to_numpy(dtype=np.float64)
+        if compact:
+            values = encode_ratings(values)
+            user_ids = user_ids.astype(np.int32)
+            movie_ids = movie_ids.astype(np.int32)
+
+        csr = sparse.csr_matrix(
+            (values, (rows.astype(np.int32), cols.astype(np.int32))),
+            shape=(len(user_ids), len(movie_ids)),
+        )
+        return cls(user_ids, movie_ids, csr)
+
+    @classmethod
+    def from_csv_chunks(
+        cls,
+        csv_path: str,
+        chunksize: int = 1_000_000,
+        compact: bool = False,
+        progress: Callable[[int, int], None] = None,
+    ) -> "RatingsStore":
+        """
+        Build the store from ratings.csv by streaming it in chunks.
+
+        The file is read twice: the first pass collects the user and movie ids
+        and the number of ratings of each user, the second pass writes every
+        chunk straight into the preallocated CSR arrays. The whole file is
+        never in memory, so the peak memory is one chunk plus the store.
+
+        Args:
+            csv_path (str): path to ratings.csv
+            chunksize (int): number of csv rows read at once
+            compact (bool): keep the ratings as 8-bit codes and the ids as int32
+            progress (Callable[[int, int], None]): called after every chunk with
+                the pass number (1 or 2) and the number of rows read so far
+
+        Returns:
+            RatingsStore: sparse ratings store
+        """
+
+        def read_chunks():
+            return pd.read_csv(
+                csv_path,
+                usecols=["userId", "movieId", "rating"],
+                dtype={"userId": np.int64, "movieId": np.int64, "rating": np.float64},
+                chunksize=chunksize,
+            )
+
+        # 1st pass: ids and rating counts of the users
+        user_ids = np.empty(0, dtype=np.int64)
+        user_counts = np.empty(0, dtype=np.int64)
+        movie_ids = np.empty(0, dtype=np.int64)
+        rows_read = 0
+        for chunk in read_chunks():
+            chunk_users, chunk_counts = np.unique(
+                chunk["userId"].to_numpy(), return_counts=True
+            )
+            user_ids, inverse = np.unique(
+                np.concatenate([user_ids, chunk_users]), return_inverse=True
+            )
+            user_counts = np.bincount(
+                inverse,
+                weights=np.concatenate([user_counts, chunk_counts]),
+                minlength=len(user_ids),
+            ).astype(np.int64)
+            movie_ids = np.union1d(movie_ids, chunk["movieId"].to_numpy())
+
+            rows_read += len(chunk)
+            if progress is not None:
+                progress(1, rows_read)
+
+        index_dtype = np.int32 if rows_read < np.iinfo(np.int32).max else np.int64
+        indptr = np.zeros(len(user_ids) + 1, dtype=index_dtype)
+        np.cumsum(user_counts, out=indptr[1:])
+        indices = np.empty(rows_read, dtype=index_dtype)
+        data = np.empty(rows_read, dtype=np.uint8 if compact else np.float64)
+
+        # 2nd pass: write each rating to the next free position of its row
+        next_free = indptr[:-1].astype(np.int64)
+        rows_read = 0
+        for chunk in read_chunks():
+            rows = np.searchsorted(user_ids, chunk["userId"].to_numpy())
+            cols = np.searchsorted(movie_ids, chunk["movieId"].to_numpy())
+            values = chunk["rating"].to_numpy()
+
+            # position of each rating among the chunk's ratings of the same row
+            order = np.argsort(rows, kind="stable")
+            sorted_rows = rows[order]
+            counts = np.bincount(sorted_rows, minlength=len(user_ids))
+            group_starts = np.cumsum(counts) - counts
+            offsets = np.arange(len(order)) - group_starts[sorted_rows]
+
+            positions = next_free[sorted_rows] + offsets
+            indices[positions] = cols[order]
+            data[positions] = (
+                encode_ratings(values[order]) if compact else values[order]
+            )
+            next_free += counts
+
+            rows_read += len(chunk)
+            if progress is not None:
+                progress(2, rows_read)
+
+        if compact:
+            user_ids = user_ids.astype(np.int32)
+            movie_ids = movie_ids.astype(np.int32)
+        csr = sparse.csr_matrix(
+            (data, indices, indptr), shape=(len(user_ids), len(movie_ids)), copy=False
+        )
+        # the movies of each row are sorted when the store is created
+        return cls(user_ids, movie_ids, csr)
+
+    @classmethod
+    def from_user_movie_df(cls, user_movie_df: pd.DataFrame) -> "RatingsStore":
+        """
+        Build the store from a pivoted user-movie dataframe.
+
+        Args:
+            user_movie_df (pd.DataFrame): userIds as index, movieIds as columns
+
+        Returns:
+            RatingsStore: sparse ratings store
+        """
+
+        values = user_movie_df.to_numpy(dtype=np.float64)
+        rows, cols = np.nonzero(~np.isnan(values))
+
+        csr = sparse.csr_matrix(
+            (values[rows, cols], (rows.astype(np.int32), cols.astype(np.int32))),
+            shape=values.shape,
+        )
+        return cls(
+            user_movie_df.index.to_numpy(), user_movie_df.columns.to_numpy(), csr
+        )
+
+    @property
+    def csr(self) -> sparse.csr_matrix:
+        """
+        Row (user) oriented ratings. Buffered changes (see set_rating) are
+        merged into it first.
+        """
+
+        if self._pending:
+            self._merge_pending()
+        return self._csr
+
+    @property
+    def csc(self) -> sparse.csc_matrix:
+        """
+        Column (movie) oriented copy of the ratings, built on first use.
+        """
+
+        csr = self.csr
+        if self._csc is None:
+            self._csc = csr.tocsc()
+            self._csc.sort_indices()
+        return self._csc
+
+    def to_compact(self) -> "RatingsStore":
+        """
+        Compact copy of the store (the store itself if it is compact already).
+        """
+
+        if self.compact:
+            return self
+        csr = sparse.csr_matrix(
+            (encode_ratings(self.csr.data), self.csr.indices, self.csr.indptr),
+            shape=self.shape,
+        )
+        return RatingsStore(
+            self.user_ids.astype(np.int32), self.movie_ids.astype(np.int32), csr
+        )
+
+    def decode(self, data: np.ndarray) -> np.ndarray:
+        """
+        Rating values of stored data (e.g. a slice of csr.data) as float64.
+        """
+
+        if self.compact:
+            return data * RATING_STEP
+        return data.astype(np.float64, copy=False)
+
+    def row_blocks(self, max_ratings: int = 1 << 20) -> list[tuple[int, int]]:
+        """
+        Split the rows into consecutive blocks [start, end) of at most
+        max_ratings ratings (a single row can be longer), so that kernels
+        decode one block of ratings at a time.
+        """
+
+        indptr = self.csr.indptr
+        n_users = self.shape[0]
+        blocks = []
+        start = 0
+        while start < n_users:
+            limit = indptr[start] + max_ratings
+            end = int(np.searchsorted(indptr, limit, side="right")) - 1
+            end = min(max(end, start + 1), n_users)
+            blocks.append((start, end))
+            start = end
+        return blocks
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the ids and the ratings, saved with the data computed from
+        the store (e.g. a similarity matrix) to check later that it is
+        reused only for the same ratings. Compact and float64 stores of the
+        same ratings have the same fingerprint. Computed once per version.
+        """
+
+        if self._fingerprint is None or self._fingerprint[0] != self.version:
+            digest = hashlib.blake2b(digest_size=16)
+            indptr = self.csr.indptr
+            for array in (self.user_ids, self.movie_ids, indptr):
+                digest.update(np.ascontiguousarray(array, dtype=np.int64))
+            for start, end in self.row_blocks():
+                block = slice(indptr[start], indptr[end])
+                indices = self.csr.indices[block]
+                digest.update(np.ascontiguousarray(indices, dtype=np.int64))
+                digest.update(np.ascontiguousarray(self.decode(self.csr.data[block])))
+            self._fingerprint = (self.version, digest.hexdigest())
+        return self._fingerprint[1]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.user_ids), len(self.movie_ids)
+
+    @property
+    def nnz(self) -> int:
+        return self.csr.nnz
+
+    def _row(self, user_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Column indices and ratings of one user.
+        """
+
+        cols, data = self._stored_row(self.user_index[user_id])
+        return cols, self.decode(data)
+
+    def user_mean(self, user_id: int) -> float:
+        """
+        Mean rating of a user (read from the statistics).
+        """
+
+        return self.stats.mean[self.user_index[user_id]]
+
+    def centered(self, rows: np.ndarray = None) -> sparse.csr_matrix:
+        """
+        Ratings centered by the users' means, for the given rows (all if None).
+        The result has the same sparsity structure as the ratings.
+        """
+
+        csr = self.csr if rows is None else self.csr[rows]
+        means = self.stats.mean if rows is None else self.stats.mean[rows]
+        data = self.decode(csr.data) - np.repeat(means, np.diff(csr.indptr))
+        return sparse.csr_matrix((data, csr.indices, csr.indptr), shape=csr.shape)
+
+    def user_ratings(self, user_id: int) -> pd.Series:
+        """
+        Ratings of a user indexed by movieId (only the rated movies).
+
+        Raises:
+            KeyError: If the user does not exist.
+        """
+
+        cols, values = self._row(user_id)
+        return pd.Series(values, index=pd.Index(self.movie_ids[cols], name="movieId"))
+
+    def rating(self, user_id: int, movie_id: int) -> float:
+        """
+        Rating the user has given to the movie, NaN if the user has not rated it.
+
+        Raises:
+            KeyError: If the user or the movie does not exist.
+        """
+
+        col = self.movie_index[movie_id]
+        cols, values = self._row(user_id)
+        pos = np.searchsorted(cols, col)
+        if pos < len(cols) and cols[pos] == col:
+            return float(values[pos])
+        return np.nan
+
+    def _stored_row(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Column indices and stored values (codes in a compact store) of one
+        row, with the buffered changes of the row applied.
+        """
+
+        csr = self._csr
+        if row < csr.shape[0]:
+            start, end = csr.indptr[row], csr.indptr[row + 1]
+            cols, data = csr.indices[start:end], csr.data[start:end]
+        else:
+            # a new user that is not in the merged matrix yet
+            cols, data = csr.indices[:0], csr.data[:0]
+
+        changes = self._pending.get(row)
+        if not changes:
+            return cols, data
+        keep = ~np.isin(cols, list(changes))
+        added = [col for col, value in changes.items() if value is not None]
+        cols = np.concatenate([cols[keep], np.array(added, dtype=cols.dtype)])
+        data = np.concatenate(
+            [data[keep], np.array([changes[col] for col in added], dtype=data.dtype)]
+        )
+        order = np.argsort(cols, kind="stable")
+        return cols[order], data[order]
+
+    def _merge_pending(self) -> None:
+        """
+        Merge the buffered changes into the CSR matrix, in one pass over the
+        ratings for all of them.
+        """
+
+        csr = self._csr
+        n_users = len(self.user_ids)
+        # new users are empty rows after the merged ones
+        indptr = np.concatenate(
+            [csr.indptr, np.full(n_users - csr.shape[0], csr.indptr[-1])]
+        )
+        counts = np.diff(indptr)
+
+        # unchanged runs of rows are copied as they are
+        data, indices = [], []
+        start = 0
+        for row in sorted(self._pending):
+            cols, values = self._stored_row(row)
+            data += [csr.data[indptr[start] : indptr[row]], values]
+            indices += [csr.indices[indptr[start] : indptr[row]], cols]
+            counts[row] = len(cols)
+            start = row + 1
+        data.append(csr.data[indptr[start] :])
+        indices.append(csr.indices[indptr[start] :])
+
+        self._pending = {}
+        self._csr = sparse.csr_matrix(
+            (
+                np.concatenate(data),
+                np.concatenate(indices),
+                np.concatenate([[0], np.cumsum(counts)]),
+            ),
+            shape=self.shape,
+        )
+        self._csc = None
+
+    def _changed(self, row: int) -> None:
+        """
+        Update the statistics and the version after the ratings of row have
+        changed.
+        """
+
+        _, data = self._stored_row(row)
+        self.stats.set_row(row, self.decode(data))
+        self.version = next(_versions)
+
+    def _add_user(self, user_id: int) -> int:
+        """
+        Row of the user, adding an empty row for a new user.
+        """
+
+        if user_id in self.user_index:
+            return self.user_index[user_id]
+
+        row = len(self.user_ids)
+        self.user_ids = np.append(self.user_ids, user_id).astype(self.user_ids.dtype)
+        self.user_index[user_id] = row
+        self.stats.grow(row + 1)
+        return row
+
+    def _add_movie(self, movie_id: int) -> int:
+        """
+        Column of the movie, adding an empty column for a new movie.
+        """
+
+        if movie_id in self.movie_index:
+            return self.movie_index[movie_id]
+
+        col = len(self.movie_ids)
+        self.movie_ids = np.append(self.movie_ids, movie_id).astype(
+            self.movie_ids.dtype
+        )
+        self.movie_index[movie_id] = col
+        return col
+
+    def set_rating(self, user_id: int, movie_id: int, rating: float) -> None:
+        """
+        Add a new rating or change an existing one.
+
+        The change is buffered and merged into the CSR matrix together with
+        the other buffered changes when the matrix is read next, so a batch
+        of changes costs one pass over the ratings. Only the statistics of
+        the user are recomputed. New users and movies are added as the last
+        row or column, so their ids are not in ascending order with the
+        others.
+
+        Args:
+            user_id (int): user
+            movie_id (int): movie
+            rating (float): new rating
+
+        Raises:
+            ValueError: If the store is compact and the rating can't be encoded.
+        """
+
+        value = encode_ratings([rating])[0] if self.compact else rating
+        row = self._add_user(user_id)
+        col = self._add_movie(movie_id)
+        self._pending.setdefault(row, {})[col] = value
+        self._changed(row)
+
+    def delete_rating(self, user_id: int, movie_id: int) -> None:
+        """
+        Delete a rating (buffered like in set_rating). The user and the movie
+        stay in the store even if they have no ratings left.
+
+        Raises:
+            KeyError: If the user has not rated the movie.
+        """
+
+        row = self.user_index[user_id]
+        col = self.movie_index[movie_id]
+        cols, _ = self._stored_row(row)
+        pos = np.searchsorted(cols, col)
+        if pos == len(cols) or cols[pos] != col:
+            raise KeyError(f"User {user_id} has not rated movie {movie_id}")
+        self._pending.setdefault(row, {})[col] = None
+        self._changed(row)
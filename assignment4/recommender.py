@@ -0,0 +1,176 @@
+"""
+DATA.ML.360 Recommender Systems
+Recommender model that is kept up to date when ratings are added, changed
+or deleted.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import assignment1 as asg1
+import similarity
+from ratings_store import RatingsStore
+
+
+class Recommender:
+    """
+    User-based collaborative filtering model on a RatingsStore.
+
+    The similar users and the recommendations of a user are cached when
+    they are first requested. When a rating of a user changes, only the
+    user's statistics and its similarities to the other users are
+    recomputed: the similarities between the other users stay the same.
+    Therefore only the cached results of the user and of the users that
+    have it among their neighbors before or after the change are dropped.
+    """
+
+    def __init__(
+        self,
+        store: RatingsStore,
+        similarity_type: str = "pearson",
+        k: int = asg1.SIMILAR_USERS,
+        similarity_matrix: similarity.SimilarityMatrix = None,
+    ):
+        """
+        Args:
+            store (RatingsStore): ratings, changed in place by the updates
+            similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+            k (int): number of similar users the predictions are based on
+            similarity_matrix (SimilarityMatrix): precomputed similarities
+                of the store, updated together with the ratings
+
+        Raises:
+            ValueError: If the similarity matrix is for another similarity type.
+        """
+
+        if (
+            similarity_matrix is not None
+            and similarity_matrix.similarity_type != similarity_type
+        ):
+            raise ValueError(
+                f"Similarity matrix is for {similarity_matrix.similarity_type} "
+                f"similarity, not {similarity_type}"
+            )
+
+        self.store = store
+        self.similarity_type = similarity_type
+        self.k = k
+        self.similarity_matrix = similarity_matrix
+
+        # user_id -> cached similar users and recommendations
+        self._neighbors: dict[int, list[tuple[int, float]]] = {}
+        self._recs: dict[int, list[tuple[int, float]]] = {}
+
+    def similar_users(self, user_id: int) -> list[tuple[int, float]]:
+        """
+        The k most similar users of a user (see asg1.get_similar_users).
+        """
+
+        if user_id not in self._neighbors:
+            self._neighbors[user_id] = asg1.get_similar_users(
+                self.store,
+                user_id,
+                self.similarity_type,
+                self.k,
+                self.similarity_matrix,
+            )
+        return self._neighbors[user_id]
+
+    def top_movies(self, user_id: int) -> list[tuple[int, float]]:
+        """
+        Predictions for all movies in descending order (see asg1.get_top_movies).
+        """
+
+        if user_id not in self._recs:
+            self._recs[user_id] = asg1.rank_movies(
+                self.store, user_id, self.similar_users(user_id)
+            )
+        return self._recs[user_id]
+
+    def set_rating(self, user_id: int, movie_id: int, rating: float) -> set[int]:
+        """
+        Add a new rating or change an existing one.
+
+        Returns:
+            set[int]: users whose cached results were dropped
+        """
+
+        new_movie = movie_id not in self.store.movie_index
+        self.store.set_rating(user_id, movie_id, rating)
+        return self._refresh(user_id, new_movie)
+
+    def set_ratings(self, ratings: list[tuple[int, int, float]]) -> set[int]:
+        """
+        Add or change many ratings at once. The store merges the changes in
+        one pass, and the similarities of every changed user are recomputed
+        only once.
+
+        Args:
+            ratings (list[tuple[int, int, float]]): (user_id, movie_id, rating)
+
+        Returns:
+            set[int]: users whose cached results were dropped
+        """
+
+        new_movie = False
+        users = {}
+        for user_id, movie_id, rating in ratings:
+            new_movie |= movie_id not in self.store.movie_index
+            self.store.set_rating(user_id, movie_id, rating)
+            users[user_id] = None
+
+        stale = set()
+        for user_id in users:
+            stale |= self._refresh(user_id, new_movie)
+        return stale
+
+    def delete_rating(self, user_id: int, movie_id: int) -> set[int]:
+        """
+        Delete a rating.
+
+        Returns:
+            set[int]: users whose cached results were dropped
+
+        Raises:
+            KeyError: If the user has not rated the movie.
+        """
+
+        self.store.delete_rating(user_id, movie_id)
+        return self._refresh(user_id)
+
+    def _refresh(self, user_id: int, new_movie: bool = False) -> set[int]:
+        """
+        Update the similarities of a user whose ratings have changed and drop
+        the cached results that depend on them.
+        """
+
+        if self.similarity_matrix is not None:
+            self.similarity_matrix.update_user(self.store, user_id, self.k)
+            sims = self.similarity_matrix.sims[
+                self.similarity_matrix.user_index[user_id]
+            ]
+        else:
+            sims = similarity.similarity_to_all(
+                self.store, user_id, self.similarity_type
+            )
+
+        stale = {user_id}
+        for other, neighbors in self._neighbors.items():
+            if other == user_id:
+                continue
+            was_neighbor = any(user == user_id for user, _ in neighbors)
+            # the user can enter the neighborhood if it is at least as
+            # similar as the last neighbor
+            enters = (
+                len(neighbors) < self.k
+                or sims[self.store.user_index[other]] >= neighbors[-1][1]
+            )
+            if was_neighbor or enters:
+                stale.add(other)
+
+        for user in stale:
+            self._neighbors.pop(user, None)
+            self._recs.pop(user, None)
+        # all movies are predicted, so every list is missing a new movie
+        if new_movie:
+            self._recs.clear()
+        return stale
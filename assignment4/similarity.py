@@ -0,0 +1,784 @@
+"""
+DATA.ML.360 Recommender Systems
+Vectorized user similarity calculations on the sparse ratings store.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import json
+import os
+from typing import NamedTuple
+
+import numpy as np
+from scipy import sparse
+
+from ratings_store import RatingsStore
+
+# NOTE similarity is 0 when users have less than 3 common movies
+MIN_COMMON_MOVIES = 3
+SIMILARITY_TYPES = ("pearson", "cosine", "adjusted_cosine")
+
+
+def _with_data(csr: sparse.csr_matrix, data: np.ndarray) -> sparse.csr_matrix:
+    """
+    Matrix with the same sparsity structure as csr but different values.
+    The index arrays are shared, only data is new.
+    """
+
+    return sparse.csr_matrix((data, csr.indices, csr.indptr), shape=csr.shape)
+
+
+def rating_values(store: RatingsStore, similarity_type: str, rows=None) -> np.ndarray:
+    """
+    Rating values used by the similarity type, in the order of store.csr.data,
+    for a slice or an array of rows (all if None). Values are mean-centered for pearson
+    and adjusted cosine.
+    """
+
+    if similarity_type == "cosine":
+        csr = store.csr if rows is None else store.csr[rows]
+        return store.decode(csr.data)
+    return store.centered(rows).data
+
+
+def similarity_to_all(
+    store: RatingsStore, user_id: int, similarity_type: str = "pearson"
+) -> np.ndarray:
+    """
+    Calculate similarity of one user against all users in one pass.
+
+    Gives the same values as pearson_corr and cosine_sim in assignment1:
+    sums are taken over the common movies only, but the means used for
+    centering are the means over all ratings of the user. Adjusted cosine
+    similarity is the same formula as the pearson correlation.
+
+    Args:
+        store (RatingsStore): ratings
+        user_id (int): active user
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+
+    Returns:
+        np.ndarray: similarity for every user, indexed by store row
+                    (including the active user itself)
+    """
+
+    user_values, user_rated = _user_vectors(store, user_id, similarity_type)
+
+    # the other users' ratings are decoded one block of rows at a time
+    sims = np.zeros(store.shape[0])
+    for start, end in store.row_blocks():
+        rows = slice(start, end)
+        sims[rows] = _similarity_to_rows(
+            store, rows, similarity_type, user_values, user_rated
+        )
+    return sims
+
+
+def similarity_to_users(
+    store: RatingsStore,
+    user_id: int,
+    rows: np.ndarray,
+    similarity_type: str = "pearson",
+) -> np.ndarray:
+    """
+    Calculate similarity of one user against the users in the given rows only,
+    with the same values as similarity_to_all.
+
+    Args:
+        store (RatingsStore): ratings
+        user_id (int): active user
+        rows (np.ndarray): store rows of the other users
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+
+    Returns:
+        np.ndarray: similarity for every row in rows
+    """
+
+    user_values, user_rated = _user_vectors(store, user_id, similarity_type)
+    return _similarity_to_rows(store, rows, similarity_type, user_values, user_rated)
+
+
+def similarity_to_all_many(
+    store: RatingsStore, user_ids: list[int], similarity_type: str = "pearson"
+) -> np.ndarray:
+    """
+    Calculate similarity of a few users against all users in one pass,
+    with the same values as similarity_to_all for each of them.
+
+    The users are the columns of dense (movies x users) vectors, so the
+    other users' ratings are read once for all of them. This is for small
+    groups: the operands of similarity_rows cost more to build than a few
+    passes over the ratings.
+
+    Args:
+        store (RatingsStore): ratings
+        user_ids (list[int]): active users
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+
+    Returns:
+        np.ndarray: similarities, shape (number of user_ids, number of users)
+    """
+
+    users_values, users_rated = _users_vectors(store, user_ids, similarity_type)
+
+    sims = np.zeros((len(user_ids), store.shape[0]))
+    for start, end in store.row_blocks():
+        rows = slice(start, end)
+        sims[:, rows] = _similarity_to_rows(
+            store, rows, similarity_type, users_values, users_rated
+        ).T
+    return sims
+
+
+def _user_vectors(
+    store: RatingsStore, user_id: int, similarity_type: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Dense rating values of a user and 1 for its rated movies, over all movies.
+    """
+
+    csr = store.csr
+    row = store.user_index[user_id]
+    user_block = csr[row : row + 1]
+
+    user_values = np.zeros(csr.shape[1])
+    user_values[user_block.indices] = rating_values(
+        store, similarity_type, slice(row, row + 1)
+    )
+    user_rated = np.zeros(csr.shape[1])
+    user_rated[user_block.indices] = 1.0
+    return user_values, user_rated
+
+
+def _users_vectors(
+    store: RatingsStore, user_ids: list[int], similarity_type: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    _user_vectors of many users as the columns of (movies x users) arrays.
+    """
+
+    rows = np.array([store.user_index[user_id] for user_id in user_ids], dtype=int)
+    users_block = store.csr[rows]
+    # column of every rating in the (movies x users) arrays
+    users = np.repeat(np.arange(len(rows)), np.diff(users_block.indptr))
+
+    users_values = np.zeros((users_block.shape[1], len(rows)))
+    users_values[users_block.indices, users] = rating_values(
+        store, similarity_type, rows
+    )
+    users_rated = np.zeros((users_block.shape[1], len(rows)))
+    users_rated[users_block.indices, users] = 1.0
+    return users_values, users_rated
+
+
+def _similarity_to_rows(
+    store: RatingsStore,
+    rows,
+    similarity_type: str,
+    user_values: np.ndarray,
+    user_rated: np.ndarray,
+) -> np.ndarray:
+    """
+    Similarities of the users in rows (slice or array) against a user given
+    as the dense vectors of _user_vectors (or many users as the columns of
+    _users_vectors, then the result has a column per user).
+    """
+
+    block = store.csr[rows]
+    values = rating_values(store, similarity_type, rows)
+
+    rated = _with_data(block, np.ones_like(values))
+    numerator = _with_data(block, values) @ user_values
+    # squared norms of both users over the common movies only
+    user_norm2 = rated @ (user_values**2)
+    other_norm2 = _with_data(block, values**2) @ user_rated
+    common = rated @ user_rated
+
+    denominator = np.sqrt(user_norm2) * np.sqrt(other_norm2)
+    valid = (common >= MIN_COMMON_MOVIES) & (denominator != 0)
+    sims = np.zeros(numerator.shape)
+    sims[valid] = numerator[valid] / denominator[valid]
+    return sims
+
+
+def top_k(values: np.ndarray, k: int = None, exclude: int = None) -> np.ndarray:
+    """
+    Indices of the k largest values in descending order. Ties are broken by
+    the ascending index, so the result is the same as the first k items of
+    a stable descending sort.
+
+    Only the k selected values are sorted: the rest are dropped with a
+    partial selection in O(n), so the cost is O(n + k log k) instead of
+    O(n log n).
+
+    Args:
+        values (np.ndarray): 1D array of values
+        k (int): number of indices to return (all if None)
+        exclude (int): index that is never selected (e.g. the active user)
+
+    Returns:
+        np.ndarray: indices of the selected values
+    """
+
+    if exclude is not None:
+        values = values.copy()
+        values[exclude] = -np.inf
+    n = len(values) - (exclude is not None)
+    if k is None or k >= n:
+        return np.argsort(-values, kind="stable")[:n]
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # the k-th largest value, all larger values are always selected
+    # and the ties with it are filled in the ascending index order
+    kth = np.partition(values, len(values) - k)[len(values) - k]
+    larger = np.flatnonzero(values > kth)
+    ties = np.flatnonzero(values == kth)[: k - len(larger)]
+    selected = np.concatenate([larger, ties])
+    return selected[np.lexsort((selected, -values[selected]))]
+
+
+def rank_users(
+    store: RatingsStore, sims: np.ndarray, user_id: int, k: int = None
+) -> list[tuple[int, float]]:
+    """
+    Sort users by similarity in descending order, leaving out the active user.
+    Ties keep the ascending user id order.
+
+    Args:
+        store (RatingsStore): ratings
+        sims (np.ndarray): similarity for every user, indexed by store row
+        user_id (int): active user
+        k (int): number of most similar users to return (all if None)
+
+    Returns:
+        list[tuple[int, float]]: (user_id, similarity) pairs
+    """
+
+    order = top_k(sims, k, exclude=store.user_index[user_id])
+    return list(zip(store.user_ids[order].tolist(), sims[order].tolist()))
+
+
+class SimilarityOperands(NamedTuple):
+    """
+    Sparse matrices used by similarity_rows: the rating values, 1 for the
+    rated movies and the squared values as users x movies, and the same
+    transposed as movies x users. All are in CSR format, so the products
+    don't have to convert them.
+    """
+
+    values: sparse.csr_matrix
+    rated: sparse.csr_matrix
+    squared: sparse.csr_matrix
+    values_t: sparse.csr_matrix
+    rated_t: sparse.csr_matrix
+    squared_t: sparse.csr_matrix
+
+
+def similarity_operands(
+    store: RatingsStore, similarity_type: str = "pearson", values: np.ndarray = None
+) -> SimilarityOperands:
+    """
+    Build the operands of similarity_rows for all users of the store.
+    The matrices share two index structures (users x movies and movies x users).
+
+    Args:
+        store (RatingsStore): ratings
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+        values (np.ndarray): precomputed rating_values
+
+    Returns:
+        SimilarityOperands: the matrices
+    """
+
+    if values is None:
+        values = rating_values(store, similarity_type)
+    return csr_operands(store.csr, values)
+
+
+def csr_operands(csr: sparse.csr_matrix, values: np.ndarray) -> SimilarityOperands:
+    """
+    Build the operands of similarity_rows for the rows of any CSR matrix,
+    e.g. with the movies as rows for item similarities.
+
+    Args:
+        csr (sparse.csr_matrix): sparsity structure
+        values (np.ndarray): values in the order of csr.data
+
+    Returns:
+        SimilarityOperands: the matrices
+    """
+
+    ones = np.ones_like(values)
+    squared = values**2
+
+    # transposing positions tells where every value moves in the transpose
+    positions = transpose_positions(csr)
+    order = positions.data
+    return SimilarityOperands(
+        _with_data(csr, values),
+        _with_data(csr, ones),
+        _with_data(csr, squared),
+        _with_data(positions, values[order]),
+        _with_data(positions, ones[order]),
+        _with_data(positions, squared[order]),
+    )
+
+
+def transpose_positions(csr: sparse.csr_matrix) -> sparse.csr_matrix:
+    """
+    Transpose of csr in CSR format whose values are the positions of the
+    values in csr.data, so that values[positions.data] is the transposed data.
+    """
+
+    return _with_data(csr, np.arange(csr.nnz)).T.tocsr()
+
+
+def similarity_rows(operands: SimilarityOperands, rows) -> np.ndarray:
+    """
+    Calculate similarities of the users in rows against all users.
+    Same values as similarity_to_all, but for many users at once.
+
+    Args:
+        operands (SimilarityOperands): matrices from similarity_operands
+        rows (slice | np.ndarray): rows of the users
+
+    Returns:
+        np.ndarray: similarities, shape (number of rows, number of users)
+    """
+
+    block_values = operands.values[rows]
+    block_rated = operands.rated[rows]
+    block_squared = operands.squared[rows]
+
+    numerator = (block_values @ operands.values_t).toarray()
+    # squared norms of both users over the common movies only
+    user_norm2 = (block_squared @ operands.rated_t).toarray()
+    other_norm2 = (block_rated @ operands.squared_t).toarray()
+    common = (block_rated @ operands.rated_t).toarray()
+
+    denominator = np.sqrt(user_norm2) * np.sqrt(other_norm2)
+    valid = (common >= MIN_COMMON_MOVIES) & (denominator != 0)
+
+    sims = np.zeros(numerator.shape)
+    sims[valid] = numerator[valid] / denominator[valid]
+    return sims
+
+
+def similarity_block(
+    store: RatingsStore,
+    start: int,
+    end: int,
+    similarity_type: str = "pearson",
+    values: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Calculate similarities of the users in rows [start, end) against all users.
+    Same values as similarity_to_all, but for a block of users at once.
+
+    Args:
+        store (RatingsStore): ratings
+        start (int): first row of the block
+        end (int): end row of the block (exclusive)
+        similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+        values (np.ndarray): precomputed rating_values
+
+    Returns:
+        np.ndarray: similarities, shape (end - start, number of users)
+    """
+
+    operands = similarity_operands(store, similarity_type, values)
+    return similarity_rows(operands, slice(start, end))
+
+
+class SimilarityMatrix:
+    """
+    Precomputed user x user similarity matrix for one similarity type.
+
+    Besides the full matrix, the most similar users of every user are stored
+    in a sorted neighbor table, so the top-k neighbors are read in O(k).
+    Saved matrices are directories of .npy files that are memory-mapped
+    when loaded. The fingerprint of the ratings (RatingsStore.fingerprint)
+    is saved with them, so a matrix of older ratings is not reused.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        similarity_type: str,
+        sims: np.ndarray,
+        neighbors: np.ndarray,
+        neighbor_sims: np.ndarray,
+        ratings_fingerprint: str = None,
+    ):
+        """
+        Args:
+            user_ids (np.ndarray): user_id of each row (same order as the store)
+            similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+            sims (np.ndarray): similarities, shape (users, users) or larger
+            neighbors (np.ndarray): rows of the most similar users of each user
+                                    in descending similarity order
+            neighbor_sims (np.ndarray): similarities of the neighbors
+            ratings_fingerprint (str): fingerprint of the ratings the matrix
+                has been computed from (None if unknown)
+        """
+
+        self.user_ids = user_ids
+        self.similarity_type = similarity_type
+        # the arrays can have room for more users (see _grow), the users
+        # are in the first rows and columns
+        self._buffers = {
+            "sims": sims,
+            "neighbors": neighbors,
+            "neighbor_sims": neighbor_sims,
+        }
+        self._resize(len(user_ids))
+        self.ratings_fingerprint = ratings_fingerprint
+
+        self.user_index: dict[int, int] = {
+            int(user_id): idx for idx, user_id in enumerate(user_ids)
+        }
+
+    @classmethod
+    def build(
+        cls,
+        store: RatingsStore,
+        similarity_type: str = "pearson",
+        path: str = None,
+        block_size: int = 256,
+        n_neighbors: int = 100,
+    ) -> "SimilarityMatrix":
+        """
+        Compute the similarities of all user pairs.
+
+        The matrix is computed in blocks of block_size users, so the peak
+        memory use on top of the result is about block_size x users values.
+        If path is given, the result is written to a memory-mapped file
+        in that directory while it is computed.
+
+        Args:
+            store (RatingsStore): ratings
+            similarity_type (str): "pearson", "cosine" or "adjusted_cosine"
+            path (str): directory to save the matrix in (kept in memory if None)
+            block_size (int): number of users computed at once
+            n_neighbors (int): length of the sorted neighbor table of each user
+
+        Returns:
+            SimilarityMatrix: the computed matrix
+
+        Raises:
+            ValueError: If the similarity type is unknown.
+        """
+
+        if similarity_type not in SIMILARITY_TYPES:
+            raise ValueError(f"Unknown similarity type {similarity_type}")
+
+        n_users = store.shape[0]
+        n_neighbors = min(n_neighbors, n_users - 1)
+        shapes = {
+            "sims": ((n_users, n_users), np.float64),
+            "neighbors": ((n_users, n_neighbors), np.int32),
+            "neighbor_sims": ((n_users, n_neighbors), np.float64),
+        }
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            arrays = {
+                name: np.lib.format.open_memmap(
+                    os.path.join(path, f"{name}.npy"), "w+", dtype, shape
+                )
+                for name, (shape, dtype) in shapes.items()
+            }
+        else:
+            arrays = {
+                name: np.empty(shape, dtype) for name, (shape, dtype) in shapes.items()
+            }
+
+        operands = similarity_operands(store, similarity_type)
+        for start in range(0, n_users, block_size):
+            end = min(start + block_size, n_users)
+            block = similarity_rows(operands, slice(start, end))
+            arrays["sims"][start:end] = block
+
+            # most similar users by descending similarity, ties by ascending
+            # user id, leaving the user itself out
+            for row in range(start, end):
+                sims = block[row - start]
+                order = top_k(sims, n_neighbors, exclude=row)
+                arrays["neighbors"][row] = order
+                arrays["neighbor_sims"][row] = sims[order]
+
+        matrix = cls(store.user_ids, similarity_type, **arrays)
+        matrix.ratings_fingerprint = store.fingerprint()
+        if path is not None:
+            matrix.save(path)
+        return matrix
+
+    def save(self, path: str, store: RatingsStore = None) -> None:
+        """
+        Save the matrix into the directory path. Arrays that are already
+        memory-mapped into that directory are only flushed. With store, the
+        matrix is saved as computed from its ratings (e.g. after update_user).
+        """
+
+        if store is not None:
+            self.ratings_fingerprint = store.fingerprint()
+        os.makedirs(path, exist_ok=True)
+        for name in ("sims", "neighbors", "neighbor_sims"):
+            array = getattr(self, name)
+            file_path = os.path.join(path, f"{name}.npy")
+            if isinstance(array, np.memmap) and os.path.samefile(
+                array.filename, file_path
+            ):
+                array.flush()
+            else:
+                np.save(file_path, array)
+        np.save(os.path.join(path, "user_ids.npy"), self.user_ids)
+        self._save_meta(path)
+
+    def _save_meta(self, path: str) -> None:
+        """
+        Write the similarity type and the ratings fingerprint into meta.json.
+        """
+
+        meta = {
+            "similarity_type": self.similarity_type,
+            "ratings_fingerprint": self.ratings_fingerprint,
+        }
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(meta, file)
+
+    @classmethod
+    def load(cls, path: str, writable: bool = False) -> "SimilarityMatrix":
+        """
+        Load a matrix saved with save (or build). The arrays are memory-mapped,
+        so only the rows that are used are read from the disk. With
+        writable=True, changes made by update_user are written to the files.
+        """
+
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        mmap_mode = "r+" if writable else "r"
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ("sims", "neighbors", "neighbor_sims")
+        }
+        user_ids = np.load(os.path.join(path, "user_ids.npy"))
+        return cls(
+            user_ids,
+            meta["similarity_type"],
+            **arrays,
+            ratings_fingerprint=meta.get("ratings_fingerprint"),
+        )
+
+    def matches(self, store: RatingsStore) -> bool:
+        """
+        Check that the matrix has been computed from the ratings of the store.
+        """
+
+        return (
+            np.array_equal(self.user_ids, store.user_ids)
+            and self.ratings_fingerprint == store.fingerprint()
+        )
+
+    def _resize(self, n_users: int) -> None:
+        """
+        Point sims, neighbors and neighbor_sims to the first n_users rows
+        (and columns) of the arrays.
+        """
+
+        self.sims = self._buffers["sims"][:n_users, :n_users]
+        self.neighbors = self._buffers["neighbors"][:n_users]
+        self.neighbor_sims = self._buffers["neighbor_sims"][:n_users]
+
+    def _reallocate(self, capacity: int) -> None:
+        """
+        Move the arrays into larger ones with room for capacity users. Arrays
+        that are memory-mapped writable are replaced by larger files, the
+        others are copied into memory.
+        """
+
+        n_users = len(self.user_ids)
+        for name, buffer in self._buffers.items():
+            shape = (capacity, capacity if name == "sims" else buffer.shape[1])
+            used = (slice(n_users), slice(n_users if name == "sims" else None))
+            if isinstance(buffer, np.memmap) and buffer.flags.writeable:
+                temp_path = f"{buffer.filename}.grow"
+                grown = np.lib.format.open_memmap(temp_path, "w+", buffer.dtype, shape)
+                grown[used] = buffer[used]
+                grown.flush()
+                del grown
+                os.replace(temp_path, buffer.filename)
+                self._buffers[name] = np.load(buffer.filename, mmap_mode="r+")
+            else:
+                grown = np.zeros(shape, dtype=buffer.dtype)
+                grown[used] = buffer[used]
+                self._buffers[name] = grown
+
+    def _grow(self, store: RatingsStore) -> np.ndarray:
+        """
+        Add the users that have been added to the store after the matrix was
+        computed (with similarity 0 until they are updated). The arrays have
+        room for more users than there are, and the room is doubled when it
+        runs out, so adding users one at a time copies the matrix only
+        O(log users) times.
+
+        Returns:
+            np.ndarray: True for the rows whose neighbor table may be stale
+
+        Raises:
+            ValueError: If the matrix has been computed for other users.
+        """
+
+        n_old = len(self.user_ids)
+        n_users = store.shape[0]
+        if not np.array_equal(self.user_ids, store.user_ids[:n_old]):
+            raise ValueError("Similarity matrix has been computed for other users")
+
+        stale = np.zeros(n_users, dtype=bool)
+        if n_users == n_old:
+            return stale
+
+        # the new users (similarity 0) can only enter tables that end
+        # with a negative similarity
+        if self.neighbors.shape[1]:
+            stale[:n_old] = self.neighbor_sims[:, -1] < 0
+        stale[n_old:] = True
+
+        capacity = self._buffers["sims"].shape[0]
+        if n_users > capacity:
+            self._reallocate(max(n_users, 2 * capacity))
+        self._resize(n_users)
+        self.sims[n_old:] = 0
+        self.sims[:, n_old:] = 0
+        self.neighbors[n_old:] = 0
+        self.neighbor_sims[n_old:] = 0
+
+        self.user_ids = store.user_ids.copy()
+        for idx in range(n_old, n_users):
+            self.user_index[int(self.user_ids[idx])] = idx
+        return stale
+
+    def update_user(self, store: RatingsStore, user_id: int, k: int = None) -> set[int]:
+        """
+        Update the matrix after the ratings of one user have changed.
+
+        The ratings (and the mean) of a user only affect its similarities to
+        the others, so only the row and column of the user are recomputed,
+        in a single pass over the ratings. The neighbor tables are re-sorted
+        only for the user and the users whose table contained the user or
+        that the user now enters.
+
+        Args:
+            store (RatingsStore): ratings after the change
+            user_id (int): user whose ratings have changed
+            k (int): neighborhood size to report changes for
+                     (the neighbor table length if None)
+
+        Returns:
+            set[int]: the user and the users that have it among their k most
+                      similar users before or after the change
+
+        Raises:
+            ValueError: If the matrix has been computed for other users.
+        """
+
+        # memory-mapped arrays loaded read-only are copied into memory
+        for name, buffer in self._buffers.items():
+            if not buffer.flags.writeable:
+                self._buffers[name] = np.array(buffer)
+        self._resize(len(self.user_ids))
+
+        # the matrix no longer matches the ratings it was saved with: the
+        # saved fingerprint is cleared before the files are changed in place
+        # (save(path, store) records the fingerprint of the new ratings)
+        if self.ratings_fingerprint is not None:
+            self.ratings_fingerprint = None
+            if isinstance(self.sims, np.memmap):
+                self._save_meta(os.path.dirname(self.sims.filename))
+
+        stale = self._grow(store)
+
+        row = self.user_index[user_id]
+        width = self.neighbors.shape[1]
+        k = width if k is None else min(k, width)
+        was_neighbor = np.any(self.neighbors[:, :k] == row, axis=1)
+
+        sims = similarity_to_all(store, user_id, self.similarity_type)
+        self.sims[row] = sims
+        self.sims[:, row] = sims
+
+        if width:
+            stale |= np.any(self.neighbors == row, axis=1)
+            stale |= sims >= self.neighbor_sims[:, -1]
+        stale[row] = True
+        for other in np.flatnonzero(stale):
+            other_sims = np.asarray(self.sims[other])
+            order = top_k(other_sims, width, exclude=other)
+            self.neighbors[other] = order
+            self.neighbor_sims[other] = other_sims[order]
+
+        is_neighbor = np.any(self.neighbors[:, :k] == row, axis=1)
+        changed = self.user_ids[was_neighbor | is_neighbor].tolist()
+        return {user_id, *changed}
+
+    def similar_users(self, user_id: int, k: int = None) -> list[tuple[int, float]]:
+        """
+        Users sorted by similarity in descending order, leaving out the user
+        itself. Ties keep the ascending user id order.
+
+        The top-k users are read from the neighbor table in O(k) when k fits
+        in it, otherwise the whole row of the matrix is sorted.
+
+        Args:
+            user_id (int): active user
+            k (int): number of users to return (all users if None)
+
+        Returns:
+            list[tuple[int, float]]: (user_id, similarity) pairs
+        """
+
+        row = self.user_index[user_id]
+        if k is not None and k <= self.neighbors.shape[1]:
+            neighbors = self.neighbors[row, :k]
+            return list(
+                zip(
+                    self.user_ids[neighbors].tolist(),
+                    self.neighbor_sims[row, :k].tolist(),
+                )
+            )
+
+        sims = np.asarray(self.sims[row])
+        order = top_k(sims, k, exclude=row)
+        return list(zip(self.user_ids[order].tolist(), sims[order].tolist()))
+
+
+def load_matrix(
+    store: RatingsStore, similarity_type: str, path: str
+) -> SimilarityMatrix:
+    """
+    Load the similarity matrix saved in path. Returns None if it does not
+    exist or has been computed from other ratings or for another similarity
+    type.
+    """
+
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    matrix = SimilarityMatrix.load(path)
+    if matrix.similarity_type == similarity_type and matrix.matches(store):
+        return matrix
+    return None
+
+
+def load_or_build_matrix(
+    store: RatingsStore, similarity_type: str, path: str
+) -> SimilarityMatrix:
+    """
+    Load the similarity matrix saved in path, or build and save it if it does
+    not exist or has been computed from other ratings or for another
+    similarity type.
+    """
+
+    matrix = load_matrix(store, similarity_type, path)
+    if matrix is None:
+        matrix = SimilarityMatrix.build(store, similarity_type, path)
+    return matrix
@@ -0,0 +1,56 @@
+"""
+DATA.ML.360 Recommender Systems
+Tests for the rank aggregation in disagreement.py.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import numpy as np
+import pytest
+
+import disagreement
+
+
+def test_kendall_tau_matches_quadratic():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        # lists with only some movies in common, of different lengths
+        movies1 = rng.choice(60, rng.integers(0, 40), replace=False).tolist()
+        movies2 = rng.choice(60, rng.integers(0, 40), replace=False).tolist()
+
+        expected = disagreement.kendall_tau_quadratic(movies1, movies2)
+        assert disagreement.kendall_tau(movies1, movies2) == expected
+
+    for kendall_tau in (disagreement.kendall_tau, disagreement.kendall_tau_quadratic):
+        with pytest.raises(ValueError):
+            kendall_tau([1, 2, 3, 4], [4, 2, 4, 3])
+
+
+def test_borda_uses_ranks_among_chosen_movies():
+    # The users' lists are longer than n: movie 2 is far down in the first
+    # list, but all users still rank only 1 and 2 among the chosen movies.
+    recommendations_list = [
+        [1, *range(10, 18), 2, 3],
+        [2, 1, *range(20, 28), 3],
+        [2, 1, *range(30, 38), 3],
+    ]
+
+    aggregation = disagreement.borda_aggregation(recommendations_list, 2)
+
+    assert aggregation.order == [2, 1]
+    assert aggregation.disagreement == 1
+
+
+def test_kemeny_dp_rejects_too_many_movies():
+    recommendations_list = [
+        list(range(20)),
+        list(range(19, -1, -1)),
+        [*range(10, 20), *range(10)],
+    ]
+    n = disagreement.DP_MAX_MOVIES
+
+    order = disagreement.modified_kemeny_young(recommendations_list, 4, method="dp")
+    assert order == disagreement.modified_kemeny_young(recommendations_list, 4)
+
+    with pytest.raises(ValueError):
+        disagreement.modified_kemeny_young(recommendations_list, n + 1, method="dp")
@@ -0,0 +1,179 @@
+"""
+DATA.ML.360 Recommender Systems
+Tests for the incremental rating updates in ratings_store.py, similarity.py
+and recommender.py: a changed store must give the same results as a store
+built fresh from the same ratings.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import similarity
+from ratings_store import RatingsStore
+from recommender import Recommender
+
+SIMILARITY_TYPE = "pearson"
+K = 5
+
+
+def random_ratings(seed: int, n_users: int = 30, n_movies: int = 40) -> pd.DataFrame:
+    """
+    ratings.csv like dataframe where every user has rated about half of the
+    movies.
+    """
+
+    rng = np.random.default_rng(seed)
+    users, movies = np.nonzero(rng.random((n_users, n_movies)) < 0.5)
+    return pd.DataFrame(
+        {
+            "userId": users + 1,
+            "movieId": movies + 1,
+            "rating": rng.integers(1, 11, len(users)) / 2,
+        }
+    )
+
+
+def changes(ratings: pd.DataFrame) -> list[tuple[int, int, float]]:
+    """
+    (user_id, movie_id, rating) changes: new and changed ratings, and new
+    users and movies with ids larger than the existing ones, so that they
+    are added in the same order as a fresh store sorts them.
+    """
+
+    first = ratings.iloc[0]
+    new_users = range(ratings["userId"].max() + 1, ratings["userId"].max() + 40)
+    return [
+        (int(first["userId"]), int(first["movieId"]), 0.5),
+        (2, 3, 4.0),
+        (5, ratings["movieId"].max() + 1, 3.5),
+        *[
+            (user, movie, user % 9 / 2 + 0.5)
+            for user in new_users
+            for movie in range(1, 5)
+        ],
+    ]
+
+
+def apply(
+    ratings: pd.DataFrame,
+    new_ratings: list[tuple[int, int, float]],
+    deleted: list[tuple[int, int]],
+) -> pd.DataFrame:
+    """
+    The ratings after the changes, as a new dataframe.
+    """
+
+    ratings = ratings.set_index(["userId", "movieId"])["rating"].copy()
+    for user_id, movie_id, rating in new_ratings:
+        ratings[(user_id, movie_id)] = rating
+    ratings = ratings.drop(index=deleted)
+    return ratings.reset_index()
+
+
+def deleted_ratings(ratings: pd.DataFrame) -> list[tuple[int, int]]:
+    """
+    A few existing ratings to delete.
+    """
+
+    return [
+        tuple(map(int, row)) for row in ratings[["userId", "movieId"]].iloc[5:8].values
+    ]
+
+
+def assert_same_store(store: RatingsStore, fresh: RatingsStore) -> None:
+    np.testing.assert_array_equal(store.user_ids, fresh.user_ids)
+    np.testing.assert_array_equal(store.movie_ids, fresh.movie_ids)
+    assert (store.csr != fresh.csr).nnz == 0
+    assert (store.csc != fresh.csc).nnz == 0
+    for name in ("count", "mean", "norm", "min", "max"):
+        np.testing.assert_allclose(
+            getattr(store.stats, name), getattr(fresh.stats, name), equal_nan=True
+        )
+    assert store.fingerprint() == fresh.fingerprint()
+
+
+def assert_same_recommendations(model: Recommender, fresh: RatingsStore) -> None:
+    fresh_model = Recommender(fresh, SIMILARITY_TYPE, K)
+    for user_id in fresh.user_ids.tolist():
+        assert model.similar_users(user_id) == fresh_model.similar_users(user_id)
+        assert model.top_movies(user_id) == fresh_model.top_movies(user_id)
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_updates_match_fresh_store(batch):
+    ratings = random_ratings(0)
+    new_ratings = changes(ratings)
+    deleted = deleted_ratings(ratings)
+    model = Recommender(RatingsStore.from_ratings(ratings), SIMILARITY_TYPE, K)
+
+    # cached results of the old ratings have to be dropped by the updates
+    for user_id in model.store.user_ids.tolist():
+        model.top_movies(user_id)
+
+    if batch:
+        model.set_ratings(new_ratings)
+    else:
+        for user_id, movie_id, rating in new_ratings:
+            model.set_rating(user_id, movie_id, rating)
+    for user_id, movie_id in deleted:
+        model.delete_rating(user_id, movie_id)
+
+    fresh = RatingsStore.from_ratings(apply(ratings, new_ratings, deleted))
+    assert_same_store(model.store, fresh)
+    assert_same_recommendations(model, fresh)
+
+
+def test_reads_between_updates_see_pending_changes():
+    ratings = random_ratings(1)
+    store = RatingsStore.from_ratings(ratings)
+    user_id, movie_id = deleted_ratings(ratings)[0]
+
+    store.set_rating(user_id, movie_id, 5.0)
+    assert store.rating(user_id, movie_id) == 5.0
+    assert store.user_ratings(user_id)[movie_id] == 5.0
+    store.delete_rating(user_id, movie_id)
+    assert np.isnan(store.rating(user_id, movie_id))
+    with pytest.raises(KeyError):
+        store.delete_rating(user_id, movie_id)
+
+    fresh = RatingsStore.from_ratings(apply(ratings, [], [(user_id, movie_id)]))
+    assert_same_store(store, fresh)
+
+
+@pytest.mark.parametrize("writable", [False, True])
+def test_memmapped_matrix_updates_match_fresh_build(tmp_path, writable):
+    ratings = random_ratings(2)
+    new_ratings = changes(ratings)
+    deleted = deleted_ratings(ratings)
+    store = RatingsStore.from_ratings(ratings)
+    path = str(tmp_path / "matrix")
+    similarity.SimilarityMatrix.build(store, SIMILARITY_TYPE, path)
+
+    matrix = similarity.SimilarityMatrix.load(path, writable=writable)
+    model = Recommender(store, SIMILARITY_TYPE, K, matrix)
+    # the new users outgrow the matrix several times
+    for user_id, movie_id, rating in new_ratings:
+        model.set_rating(user_id, movie_id, rating)
+    for user_id, movie_id in deleted:
+        model.delete_rating(user_id, movie_id)
+
+    fresh = RatingsStore.from_ratings(apply(ratings, new_ratings, deleted))
+    assert_same_store(store, fresh)
+    fresh_matrix = similarity.SimilarityMatrix.build(fresh, SIMILARITY_TYPE)
+    np.testing.assert_array_equal(matrix.user_ids, fresh_matrix.user_ids)
+    np.testing.assert_allclose(matrix.sims, fresh_matrix.sims)
+    for user_id in fresh.user_ids.tolist():
+        assert matrix.similar_users(user_id, K) == fresh_matrix.similar_users(
+            user_id, K
+        )
+    assert_same_recommendations(model, fresh)
+
+    # the changed matrix is only reused once it is saved with the new ratings
+    assert similarity.load_matrix(fresh, SIMILARITY_TYPE, path) is None
+    matrix.save(path, store)
+    reloaded = similarity.load_matrix(fresh, SIMILARITY_TYPE, path)
+    assert reloaded is not None
+    np.testing.assert_allclose(reloaded.sims, fresh_matrix.sims)
@@ -0,0 +1,61 @@
+"""
+DATA.ML.360 Recommender Systems
+Tests for the batch recommendations in assignment1.py: recommend_many must
+give the same lists as get_top_movies for every user.
+
+Antti Pham, Sophie Tötterström
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import assignment1 as asg1
+from ratings_store import RatingsStore
+
+
+@pytest.fixture(scope="module")
+def store() -> RatingsStore:
+    # sparse ratings, so that the neighbors leave many movies unrated
+    rng = np.random.default_rng(0)
+    users, movies = np.nonzero(rng.random((60, 120)) < 0.15)
+    ratings = pd.DataFrame(
+        {
+            "userId": users + 1,
+            "movieId": movies + 1,
+            "rating": rng.integers(1, 11, len(users)) / 2,
+        }
+    )
+    return RatingsStore.from_ratings(ratings)
+
+
+@pytest.mark.parametrize("missing", asg1.MISSING_POLICIES)
+@pytest.mark.parametrize("size", [3, asg1.SMALL_GROUP + 5])
+def test_recommend_many_matches_get_top_movies(store, missing, size):
+    rng = np.random.default_rng(size)
+    users = rng.choice(store.user_ids, size, replace=False).tolist()
+
+    recs = asg1.recommend_many(store, users, missing=missing)
+
+    assert list(recs) == users
+    for user in users:
+        # the same predictions bit for bit, also the signs of zeros
+        expected = asg1.get_top_movies(store, user, missing=missing)
+        assert repr(recs[user]) == repr(expected)
+
+
+@pytest.mark.parametrize("missing", asg1.MISSING_POLICIES)
+def test_rank_movies_many_matches_rank_movies(store, missing):
+    users = store.user_ids[:10].tolist()
+    similar_users = {
+        user: asg1.get_similar_users(store, user, "pearson", asg1.SIMILAR_USERS)
+        for user in users
+    }
+    # a user without similar users gets no predictions
+    similar_users[users[0]] = []
+
+    recs = asg1.rank_movies_many(store, similar_users, missing)
+
+    for user in users:
+        expected = asg1.rank_movies(store, user, similar_users[user], missing)
+        assert repr(recs[user]) == repr(expected)